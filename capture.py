@@ -0,0 +1,165 @@
+"""
+binary packet capture and replay
+
+a capture is written by `Server(capture_path=...)` (or `SERVER_CAPTURE=<path>`) and holds every
+inbound and outbound packet with its timestamp. replay (replay.py) feeds the inbound side back into a server:
+
+    python capture.py info session.pcap
+    python capture.py replay session.pcap --speed 1     # original pacing
+    python capture.py replay session.pcap --speed 0     # as fast as possible
+"""
+from __future__ import annotations
+import argparse
+import json
+import mmap
+import struct
+import threading
+import time
+
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Iterator
+
+import settings
+import packets
+
+
+# file header: magic and the wall clock time the capture started
+FILE_HEADER = struct.Struct('<8sd')
+MAGIC = b'PXCAP001'
+# record header: seconds since start, direction, protocol, peer index, length of the raw packet
+RECORD_HEADER = struct.Struct('<dBBII')
+
+
+class Direction(IntEnum):
+    IN = 0
+    OUT = 1
+
+
+class Protocol(IntEnum):
+    UDP = 0
+    TCP = 1
+
+
+@dataclass
+class CaptureRecord:
+    timestamp: float
+    direction: Direction
+    protocol: Protocol
+    peer: int
+    data: bytes
+
+    def packet(self) -> packets.Packet:
+        return packets.Packet.deserialize(self.data)
+
+
+class PacketRecorder:
+    """
+    appends packets to a capture file, safe to call from the server's handler threads
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, 'wb')
+        self.started = time.perf_counter()
+        self.file.write(FILE_HEADER.pack(MAGIC, time.time()))
+        self.peers: dict[Any, int] = {}
+        self._lock = threading.Lock()
+
+
+    def record(self, direction: Direction, protocol: Protocol, addr: Any, data: bytes) -> None:
+        timestamp = time.perf_counter() - self.started
+        with self._lock:
+            if self.file.closed:
+                return
+            peer = self.peers.setdefault((protocol, addr), len(self.peers))
+            self.file.write(RECORD_HEADER.pack(timestamp, direction, protocol, peer, len(data)))
+            self.file.write(data)
+
+
+    def close(self) -> None:
+        with self._lock:
+            self.file.close()
+
+
+class CaptureReader:
+    """
+    reads a capture through mmap, records are decoded lazily while iterating
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.started = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a packet capture")
+
+
+    def __iter__(self) -> Iterator[CaptureRecord]:
+        offset = FILE_HEADER.size
+        end = len(self.map)
+        while offset + RECORD_HEADER.size <= end:
+            timestamp, direction, protocol, peer, length = RECORD_HEADER.unpack_from(self.map, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > end:
+                # truncated tail, the server was killed mid-write
+                break
+            yield CaptureRecord(timestamp, Direction(direction), Protocol(protocol), peer, self.map[offset:offset + length])
+            offset += length
+
+
+    def close(self) -> None:
+        self.map.close()
+
+
+def summarize_capture(path: str) -> dict[str, Any]:
+    reader = CaptureReader(path)
+    counts: dict[str, int] = {}
+    size = 0
+    duration = 0.
+    for record in reader:
+        try:
+            name = packets.PacketType(record.packet().packet_type).name
+        except ValueError:
+            name = "INVALID"
+        key = f"{record.direction.name.lower()}.{record.protocol.name.lower()}.{name}"
+        counts[key] = counts.get(key, 0) + 1
+        size += len(record.data)
+        duration = record.timestamp
+    reader.close()
+
+    return {"path": path, "duration_s": round(duration, 3), "payload_bytes": size, "packets": dict(sorted(counts.items()))}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    info = commands.add_parser("info", help="count the packets in a capture")
+    info.add_argument("path")
+
+    replay_parser = commands.add_parser("replay", help="feed a capture back into a server")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--host", default=settings.HOST)
+    replay_parser.add_argument("--tcp-port", type=int, default=settings.TCP_PORT)
+    replay_parser.add_argument("--udp-port", type=int, default=settings.UDP_PORT)
+    replay_parser.add_argument("--speed", type=float, default=1., help="playback rate, 0 replays as fast as possible")
+    replay_parser.add_argument("--json", metavar="PATH", help="also write the report to PATH")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print(json.dumps(summarize_capture(args.path), indent=2))
+        return
+
+    import asyncio
+    import replay
+
+    report = asyncio.run(replay.replay(args.path, args.host, args.tcp_port, args.udp_port, args.speed))
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
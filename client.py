@@ -1,5 +1,7 @@
+import math
 import pickle
 import socket
+import struct
 import threading
 import random
 import logging
@@ -8,6 +10,11 @@ from typing import Any, Optional
 
 import settings
 import packets
+import reliable
+
+
+# how long a disconnect waits for the server to acknowledge it
+DISCONNECT_TIMEOUT = .5
 
 
 class Client:
@@ -23,10 +30,22 @@ class Client:
         self.username = username
         self.map: list[list[str]]
         self.others: dict[int, tuple[float, float]] = {}
-        self.entities: dict[int, tuple[float, float]] = {}
+        # server entity id -> kind, x, y, from the SYNC_ENTITIES stream. the version moves on every change
+        self.entities: dict[int, tuple[int, float, float]] = {}
+        self.entities_tick = 0
+        self.entities_version = 0
+        self.snapshot_tick = 0
+        # where the server placed us on join, and its latest word on our position. both are consumed by the game
+        self.spawn: Optional[tuple[float, float]] = None
+        self.server_position: Optional[tuple[float, float]] = None
+        self.reliable = reliable.ReliableChannel()
+        # handed out by the server on join, lets a dropped client come back without onboarding again
+        self.resume_token: Optional[bytes] = None
+        self.last_heard = time.perf_counter()
 
 
         self._map_has_changed = False
+        self._reconnecting = False
 
 
     @property
@@ -43,35 +62,75 @@ class Client:
 
 
     def disconnect(self, disconnect_type: packets.DisconnectEnum = packets.DisconnectEnum.UNEXPECTED) -> None:
-        packet_bytes = packets.Packet(
-                packets.PacketType.DISCONNECT,
-                self.auth_id,
-                packets.PayloadFormat.DISCONNECT.pack(disconnect_type)
-            ).serialize()
+        if self.authenticated:
+            self.send_reliable(packets.PacketType.DISCONNECT, packets.PayloadFormat.DISCONNECT.pack(disconnect_type))
+
+            # the udp thread resends until the server acknowledges, or we give up
+            deadline = time.perf_counter() + DISCONNECT_TIMEOUT
+            while self.reliable.pending and time.perf_counter() < deadline:
+                time.sleep(reliable.RESEND_INTERVAL / 2)
 
-        self.tcp_socket.sendall(packet_bytes)
         self.udp_socket = None
         self.die = True
 
 
+    def send_reliable(self, packet_type: packets.PacketType, payload: bytes) -> None:
+        wrapped = self.reliable.send(packet_type, payload, time.perf_counter())
+        self.send_packet(packets.Packet(packets.PacketType.RELIABLE, self.auth_id, wrapped))
+
+
+    def _recv_packet(self, socket: socket.socket) -> Optional[packets.Packet]:
+        """
+        read exactly one packet from a stream socket, None once the server closed it
+        """
+        def recv_exactly(size: int) -> Optional[bytes]:
+            data = b""
+            while len(data) < size:
+                chunk = socket.recv(size - len(data))
+                if not chunk:
+                    return None
+                data += chunk
+            return data
+
+        header = recv_exactly(packets.Packet.HEADER_SIZE)
+        if header is None:
+            return None
+
+        _, _, _, payload_length = struct.unpack('IIII', header)
+        payload = recv_exactly(payload_length)
+        if payload is None:
+            return None
+
+        return packets.Packet.deserialize(header + payload)
+
+
     def _start_connection_and_authenticate(self, socket: socket.socket) -> bool:
-        socket.sendall(
-            packets.Packet(
+        if self.resume_token is not None:
+            # an unknown or expired token is answered with a regular join
+            request = packets.Packet(
+                packets.PacketType.RESUME_REQUEST,
+                0,
+                packets.PayloadFormat.RESUME_REQUEST.pack(self.resume_token)
+            )
+        else:
+            request = packets.Packet(
                 packets.PacketType.JOIN_REQUEST,
                 0,
                 packets.PayloadFormat.JOIN_REQUEST.pack(self.username.encode())
-            ).serialize()
-        )
-        response = socket.recv(1024)
+            )
+        socket.sendall(request.serialize())
+        packet = self._recv_packet(socket)
 
-        packet = packets.Packet.deserialize(response)
-
-        if packet.packet_type != packets.PacketType.JOIN_RESPONSE:
+        if packet is None or packet.packet_type != packets.PacketType.JOIN_RESPONSE:
             return False
 
         id, = packets.PayloadFormat.JOIN_RESPONSE.unpack(packet.payload)
 
         if packet.packet_type == packets.PacketType.JOIN_RESPONSE and int(id) != 0 and packet.auth_id != 0:
+            if self.id and id != self.id:
+                # the resume was refused, the new session's entity stream does not know what we hold
+                self.entities = {}
+                self.entities_version += 1
             self.auth_id = packet.auth_id
             self.id = id
             logging.info(f'authenticated with auth_id {packet.auth_id} & id {id}')
@@ -82,7 +141,9 @@ class Client:
 
     def _build_map_from_payload(self, payload: bytes) -> list[list[str]]:
         rows = payload.decode()
-        rows = [rows[i:i+settings.MAP_LENGTH] for i in range(0, len(rows), settings.MAP_LENGTH)]
+        # MAP_DATA is always a square, the server's map may differ from our local copy
+        length = math.isqrt(len(rows))
+        rows = [rows[i:i+length] for i in range(0, len(rows), length)]
         map_data: list[list[str]] = []
 
         for row in rows:
@@ -91,29 +152,38 @@ class Client:
         return map_data
 
 
-    def _handle_tcp(self, data: bytes) -> None:
-
-        packet = packets.Packet.deserialize(data)
-
+    def _handle_event(self, packet: packets.Packet) -> None:
+        """
+        handles events from onboarding over tcp and from the reliable udp channel afterwards
+        """
         if packet.packet_type == packets.PacketType.MAP_DATA:
             self.map = self._build_map_from_payload(packet.payload)
             self._map_has_changed = True
             logging.debug(f"got map data:\n{self.map}")
 
+        if packet.packet_type == packets.PacketType.RESUME_TOKEN:
+            self.resume_token, = packets.PayloadFormat.RESUME_TOKEN.unpack(packet.payload)
+
         if packet.packet_type == packets.PacketType.DISCONNECT:
-            self.disconnect(packets.DisconnectEnum.EXPECTED)
+            # the server already dropped us, nothing to acknowledge
+            self.udp_socket = None
+            self.die = True
 
         if packet.packet_type == packets.PacketType.INITIAL_DATA:
             logging.info("loading initial data")
             self.others = pickle.loads(packet.payload)
             if self.id in self.others:
-                self.others.pop(self.id)
+                self.spawn = self.others.pop(self.id)
 
         logging.debug(self.others)
 
 
     def _handle_udp(self, data: bytes, addr: Any) -> None:
         packet = packets.Packet.deserialize(data)
+        if packet.auth_id != self.auth_id:
+            # addressed to the session we had before resuming
+            return
+        self.last_heard = time.perf_counter()
         logging.debug(f"{packet.auth_id} | {packet.payload}")
 
         if packet.packet_type == packets.PacketType.MOVE:
@@ -133,8 +203,39 @@ class Client:
             if self.id in self.others:
                 self.others.pop(self.id)
 
+        if packet.packet_type == packets.PacketType.SNAPSHOT:
+            tick, updates, removals = packets.decode_snapshot(packet.payload)
+            if tick < self.snapshot_tick:
+                # reordered datagram, a newer snapshot has already been applied
+                return
+            self.snapshot_tick = tick
+            if self.id in updates:
+                self.server_position = updates.pop(self.id)
+            self.others.update(updates)
+            for id in removals:
+                self.others.pop(id, None)
+
+        if packet.packet_type == packets.PacketType.PING and self.udp_socket is not None:
+            self.udp_socket.sendto(packets.Packet(packets.PacketType.PONG, self.auth_id, packet.payload).serialize(), addr)
+
+        if packet.packet_type == packets.PacketType.ACK:
+            self.reliable.on_ack(packet.payload)
+
+        if packet.packet_type == packets.PacketType.RELIABLE and self.udp_socket is not None:
+            delivered, ack = self.reliable.receive(packet.payload)
+            self.udp_socket.sendto(packets.Packet(packets.PacketType.ACK, self.auth_id, ack).serialize(), addr)
+            for packet_type, payload in delivered:
+                self._handle_event(packets.Packet(packet_type, packet.auth_id, payload))
+
         if packet.packet_type == packets.PacketType.SYNC_ENTITIES:
-            self.entities = pickle.loads(packet.payload)
+            tick, updates, removals = packets.decode_entities(packet.payload)
+            if tick < self.entities_tick:
+                return
+            self.entities_tick = tick
+            self.entities.update(updates)
+            for id in removals:
+                self.entities.pop(id, None)
+            self.entities_version += 1
 
 
     def _start_udp(self) -> None:
@@ -143,19 +244,56 @@ class Client:
 
                 logging.info("connecting through udp")
                 self.udp_socket = s
+                s.settimeout(reliable.RESEND_INTERVAL)
+                server_addr = (self.host, self.udp_port)
+                self._register_udp()
 
                 while not self.die:
-                    data, addr = s.recvfrom(1024)
-                    if not data:
-                        self.die = True
-                        logging.info("dying")
-                        break
+                    try:
+                        data, addr = s.recvfrom(65535)
+                    except TimeoutError:
+                        data, addr = None, server_addr
 
-                    self._handle_udp(data, addr)
+                    if data is not None:
+                        if not data:
+                            self.die = True
+                            logging.info("dying")
+                            break
+
+                        self._handle_udp(data, addr)
+
+                    for wrapped in self.reliable.due(time.perf_counter()):
+                        s.sendto(packets.Packet(packets.PacketType.RELIABLE, self.auth_id, wrapped).serialize(), server_addr)
+                    if self.reliable.failed or time.perf_counter() - self.last_heard > settings.CONNECTION_TIMEOUT:
+                        logging.warning("lost the server")
+                        self.reconnect()
 
         threading.Thread(target=run, daemon=True).start()
 
 
+    def _register_udp(self) -> None:
+        # lets the server learn our udp address before we first move
+        if self.udp_socket is not None:
+            self.udp_socket.sendto(
+                packets.Packet(packets.PacketType.ACK, self.auth_id, self.reliable.receive_ack()).serialize(),
+                (self.host, self.udp_port)
+            )
+
+
+    def reconnect(self) -> None:
+        """
+        pick the session back up with the resume token, or join from scratch without one. the udp socket is kept
+        """
+        if self._reconnecting or self.die:
+            return
+        self._reconnecting = True
+        self.reliable = reliable.ReliableChannel()
+        self.snapshot_tick = 0
+        self.entities_tick = 0
+        self.last_heard = time.perf_counter()
+        self.start()
+
+
     def send_packet(self, packet: packets.Packet) -> None:
         if not self.authenticated or self.udp_socket == None:
             logging.error("not authenticated! packets are being dropped")
@@ -166,20 +304,35 @@ class Client:
     def tcp_connection(self) -> None:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             self.tcp_socket = s
-            s.connect((self.host, self.tcp_port))
-            if not self._start_connection_and_authenticate(s):
+            try:
+                s.connect((self.host, self.tcp_port))
+                authenticated = self._start_connection_and_authenticate(s)
+            except OSError as e:
+                if not self._reconnecting:
+                    raise
+                # the server is still away, the udp thread tries again after another timeout
+                logging.warning(f"reconnect failed: {e}")
+                self.last_heard = time.perf_counter()
+                self._reconnecting = False
+                return
+
+            if not authenticated:
                 self.disconnect(packets.DisconnectEnum.EXPECTED)
                 return
 
-            self._start_udp()
+            if self.udp_socket is None:
+                self._start_udp()
+            else:
+                self._register_udp()
+            self._reconnecting = False
 
+            # the server closes the socket once MAP_DATA and INITIAL_DATA are sent
             while not self.die:
-                data = s.recv(1024)
-                if not data:
-                    self.die = True
+                packet = self._recv_packet(s)
+                if packet is None:
                     break
 
-                self._handle_tcp(data)
+                self._handle_event(packet)
 
 
     def start(self) -> None:
@@ -0,0 +1,182 @@
+"""
+tile-grid collision shared by the client and the server
+
+the map is compiled once into a solidity bitmap, movement is resolved per axis against it. an
+axis-aligned box of at most one tile is swept in sub-steps shorter than a tile, so fast movers can
+not tunnel through walls. `SolidityMap.move` handles one box, `SolidityMap.move_many` runs the same
+resolution over arrays of boxes with numpy when it is installed. `step` is the player's movement
+on top of it, one place for the ramp and speed the server's PLAYER_MAX_SPEED has to agree with.
+"""
+from __future__ import annotations
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    # move_many falls back to calling move in a loop
+    np = None
+
+import settings
+
+
+# keeps the far edge of a box inside the tile it touches rather than the next one
+EPSILON = 1e-6
+# player acceleration starts at a quarter of the base and ramps up to the max while a direction is held
+BASE_ACCELERATION = .25
+MAX_ACCELERATION = .5
+# acceleration gained per second of held movement, from rest to full speed in about .2s
+ACCELERATION_RAMP = 2.2
+# pixels per 100ms at an acceleration of 1, full speed is MAX_ACCELERATION * PLAYER_SPEED * 10 px/s
+PLAYER_SPEED = 25
+
+
+class SolidityMap:
+    def __init__(self, rows: list[list[str]], solid_tiles: str = settings.SOLID_TILES, tilesize: int = settings.TILESIZE) -> None:
+        # blank lines at the end of the map file carry no tiles
+        rows = [x for x in rows if any(tile.strip() for tile in x)]
+        self.tilesize = tilesize
+        self.height = len(rows)
+        self.width = max((len(x) for x in rows), default=0)
+
+        self.bits = bytearray(self.width * self.height)
+        for y, row in enumerate(rows):
+            for x, tile in enumerate(row):
+                if tile.strip() in solid_tiles:
+                    self.bits[y * self.width + x] = 1
+
+        self.grid = None
+        if np is not None:
+            self.grid = np.frombuffer(bytes(self.bits), dtype=np.uint8).reshape(self.height, self.width).astype(bool)
+
+
+    def solid(self, tile_x: int, tile_y: int) -> bool:
+        # everything outside the map is a wall
+        if not (0 <= tile_x < self.width and 0 <= tile_y < self.height):
+            return True
+        return bool(self.bits[tile_y * self.width + tile_x])
+
+
+    def _steps(self, distance: float) -> int:
+        return max(1, math.ceil(distance / (self.tilesize - 1)))
+
+
+    def _sweep_axis(self, lead: float, across: float, delta: float, size: float, vertical: bool) -> float:
+        moved = lead + delta
+        edge = moved + size - EPSILON if delta > 0 else moved
+        line = math.floor(edge / self.tilesize)
+        first = math.floor(across / self.tilesize)
+        last = math.floor((across + size - EPSILON) / self.tilesize)
+
+        for other in range(first, last + 1):
+            hit = self.solid(other, line) if vertical else self.solid(line, other)
+            if hit:
+                return line * self.tilesize - size if delta > 0 else (line + 1) * self.tilesize
+        return moved
+
+
+    def move(self, pos: tuple[float, float], delta: tuple[float, float], size: float = settings.TILESIZE) -> tuple[float, float]:
+        """
+        position of a `size` square at `pos` after moving by `delta`, stopped by solid tiles
+        """
+        x, y = pos
+        steps = self._steps(max(abs(delta[0]), abs(delta[1])))
+        dx, dy = delta[0] / steps, delta[1] / steps
+
+        for _ in range(steps):
+            if dx:
+                x = self._sweep_axis(x, y, dx, size, False)
+            if dy:
+                y = self._sweep_axis(y, x, dy, size, True)
+        return x, y
+
+
+    def _solid_many(self, tile_x, tile_y):
+        inside = (tile_x >= 0) & (tile_x < self.width) & (tile_y >= 0) & (tile_y < self.height)
+        cells = self.grid[tile_y.clip(0, self.height - 1), tile_x.clip(0, self.width - 1)]
+        return np.where(inside, cells, True)
+
+
+    def _sweep_many(self, lead, across, delta, size: float, vertical: bool):
+        moved = lead + delta
+        edge = np.where(delta > 0, moved + size - EPSILON, moved)
+        line = np.floor(edge / self.tilesize).astype(np.int64)
+        # a box of at most one tile spans at most two tiles across the direction of movement
+        first = np.floor(across / self.tilesize).astype(np.int64)
+        last = np.floor((across + size - EPSILON) / self.tilesize).astype(np.int64)
+
+        if vertical:
+            hit = self._solid_many(first, line) | self._solid_many(last, line)
+        else:
+            hit = self._solid_many(line, first) | self._solid_many(line, last)
+        hit &= delta != 0
+
+        blocked = np.where(delta > 0, line * self.tilesize - size, (line + 1) * self.tilesize)
+        return np.where(hit, blocked, moved)
+
+
+    def move_many(self, positions, deltas, size: float = settings.TILESIZE) -> list[tuple[float, float]]:
+        """
+        `move` for many boxes at once, positions and deltas are sequences of (x, y)
+        """
+        if self.grid is None:
+            return [self.move(p, d, size) for p, d in zip(positions, deltas)]
+
+        x, y = self.move_arrays(positions, deltas, size)
+        return list(zip(x.tolist(), y.tolist()))
+
+
+    def move_arrays(self, positions, deltas, size: float = settings.TILESIZE):
+        """
+        `move_many` returning the resulting x and y as ndarrays, needs numpy
+        """
+        pos = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        delta = np.asarray(deltas, dtype=np.float64).reshape(-1, 2)
+        if not len(pos):
+            return np.empty(0), np.empty(0)
+
+        # same per-box sub-steps as `move`, boxes that are done sit out the remaining iterations
+        steps = np.maximum(1, np.ceil(np.abs(delta).max(axis=1) / (self.tilesize - 1)))
+        delta = delta / steps[:, None]
+        x, y = pos[:, 0].copy(), pos[:, 1].copy()
+        for step in range(int(steps.max())):
+            active = step < steps
+            x = self._sweep_many(x, y, np.where(active, delta[:, 0], 0.), size, False)
+            y = self._sweep_many(y, x, np.where(active, delta[:, 1], 0.), size, True)
+        return x, y
+
+
+    def validate_many(self, positions, claimed, max_step: float, size: float = settings.TILESIZE) -> list[tuple[float, float]]:
+        """
+        authoritative positions, moving each box from `positions` towards `claimed` by at most `max_step`
+        """
+        if self.grid is None:
+            deltas = []
+            for (x, y), (cx, cy) in zip(positions, claimed):
+                dx, dy = cx - x, cy - y
+                scale = min(1., max_step / max(math.hypot(dx, dy), EPSILON))
+                deltas.append((dx * scale, dy * scale))
+            return self.move_many(positions, deltas, size)
+
+        pos = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        delta = np.asarray(claimed, dtype=np.float64).reshape(-1, 2) - pos
+        length = np.maximum(np.hypot(delta[:, 0], delta[:, 1]), EPSILON)
+        delta *= np.minimum(1., max_step / length)[:, None]
+        return self.move_many(pos, delta, size)
+
+
+def step(pos: tuple[float, float], direction: tuple[int, int], acceleration: float, dt: float, solidity: SolidityMap | None = None) -> tuple[tuple[float, float], float]:
+    """
+    move a player at `pos` towards `direction` (-1, 0 or 1 per axis) for `dt` ms,
+    returns the new position and the acceleration for the next step
+    """
+    velocity = direction[0] * acceleration, direction[1] * acceleration
+    if direction[0] or direction[1]:
+        # the ramp is per second so it is the same at any tick rate
+        acceleration = min(MAX_ACCELERATION, acceleration + ACCELERATION_RAMP * dt / 1000)
+    else:
+        acceleration = BASE_ACCELERATION / 4
+
+    delta = velocity[0] * PLAYER_SPEED * dt / 100, velocity[1] * PLAYER_SPEED * dt / 100
+    if solidity is None:
+        return (pos[0] + delta[0], pos[1] + delta[1]), acceleration
+    return solidity.move(pos, delta), acceleration
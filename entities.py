@@ -0,0 +1,344 @@
+"""
+server-side entities other than players
+
+entities are not objects: an `EntityPool` keeps every field in its own fixed-size array indexed by
+slot, so thousands of them cost no per-entity dicts and ticking them creates no garbage. slots are
+recycled through a free list. an id packs the slot index with the slot's generation, which is bumped
+on every despawn, so an id kept past its entity's despawn never matches whatever reuses the slot.
+
+with numpy installed the arrays are ndarrays and the tick and the per-client streams are vectorized,
+without it the same work runs in plain loops over `array.array`s. numpy is only imported once a pool
+or a stream is used, importing this module (and the server) does not pay for it.
+"""
+from __future__ import annotations
+import math
+import random
+import threading
+
+from array import array
+from functools import lru_cache
+from typing import Any
+
+import settings
+import packets
+import snapshot
+
+
+# an id is the slot's generation in the high bits and the slot index in the low bits
+INDEX_BITS = 16
+INDEX_MASK = (1 << INDEX_BITS) - 1
+GENERATION_MASK = 0xFFFF
+# a move that ends further than this from where the velocity points was stopped by a wall
+BOUNCE_EPSILON = 1e-3
+
+
+@lru_cache(maxsize=None)
+def _numpy() -> Any:
+    """
+    numpy if it is installed, imported on first use
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _filled(typecode: str, size: int, value: int | float = 0) -> Any:
+    np = _numpy()
+    if np is not None:
+        return np.full(size, value, dtype=np.dtype(typecode))
+    return array(typecode, [value]) * size
+
+
+def make_id(index: int, generation: int) -> int:
+    return (generation << INDEX_BITS) | index
+
+
+class EntityPool:
+    """
+    fixed-capacity entity storage, an id stays valid until its entity is despawned
+    """
+    __slots__ = ("capacity", "count", "x", "y", "vx", "vy", "kind", "generation", "alive", "_free", "_lock")
+
+    def __init__(self, capacity: int = settings.MAX_ENTITIES) -> None:
+        if not 0 < capacity <= INDEX_MASK + 1:
+            raise ValueError(f"entity capacity must be between 1 and {INDEX_MASK + 1}")
+
+        self.capacity = capacity
+        self.count = 0
+        self.x = _filled('f', capacity)
+        self.y = _filled('f', capacity)
+        self.vx = _filled('f', capacity)
+        self.vy = _filled('f', capacity)
+        self.kind = _filled('B', capacity)
+        # starts at 1 so no id is ever 0
+        self.generation = _filled('H', capacity, 1)
+        self.alive = _filled('B', capacity)
+        # popped from the end, the lowest slots are used first
+        self._free = array('I', range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    def __contains__(self, id: int) -> bool:
+        return self._index(id) is not None
+
+
+    def _index(self, id: int) -> int | None:
+        index = id & INDEX_MASK
+        if index >= self.capacity or not self.alive[index] or self.generation[index] != id >> INDEX_BITS:
+            return None
+        return index
+
+
+    def spawn(self, kind: packets.EntityKind, pos: tuple[float, float], velocity: tuple[float, float] = (0., 0.)) -> int | None:
+        """
+        place an entity and return its id, None when the pool is full
+        """
+        with self._lock:
+            if not self._free:
+                return None
+
+            index = self._free.pop()
+            self.x[index], self.y[index] = pos
+            self.vx[index], self.vy[index] = velocity
+            self.kind[index] = kind
+            self.alive[index] = 1
+            self.count += 1
+            return make_id(index, int(self.generation[index]))
+
+
+    def despawn(self, id: int) -> bool:
+        with self._lock:
+            index = self._index(id)
+            if index is None:
+                return False
+
+            self.alive[index] = 0
+            # wraps around, skipping 0
+            self.generation[index] = int(self.generation[index]) % GENERATION_MASK + 1
+            self._free.append(index)
+            self.count -= 1
+            return True
+
+
+    def position(self, id: int) -> tuple[float, float] | None:
+        index = self._index(id)
+        if index is None:
+            return None
+        return float(self.x[index]), float(self.y[index])
+
+
+    def ids(self) -> list[int]:
+        with self._lock:
+            return [make_id(x, int(self.generation[x])) for x in range(self.capacity) if self.alive[x]]
+
+
+    def update(self, dt: float, solidity: Any) -> None:
+        """
+        move every entity by its velocity over `dt` seconds, bouncing off solid tiles
+        """
+        with self._lock:
+            if _numpy() is not None:
+                self._update_arrays(dt, solidity)
+                return
+
+            for index in range(self.capacity):
+                vx, vy = self.vx[index], self.vy[index]
+                if not self.alive[index] or not (vx or vy):
+                    continue
+                x, y = self.x[index], self.y[index]
+                dx, dy = vx * dt, vy * dt
+                new_x, new_y = solidity.move((x, y), (dx, dy), settings.ENTITY_SIZE)
+                if abs(new_x - x - dx) > BOUNCE_EPSILON:
+                    self.vx[index] = -vx
+                if abs(new_y - y - dy) > BOUNCE_EPSILON:
+                    self.vy[index] = -vy
+                self.x[index], self.y[index] = new_x, new_y
+
+
+    def _update_arrays(self, dt: float, solidity: Any) -> None:
+        np = _numpy()
+        moving = np.flatnonzero(self.alive.astype(bool) & ((self.vx != 0) | (self.vy != 0)))
+        if not len(moving):
+            return
+
+        x, y = self.x[moving].astype(np.float64), self.y[moving].astype(np.float64)
+        vx, vy = self.vx[moving], self.vy[moving]
+        dx, dy = vx.astype(np.float64) * dt, vy.astype(np.float64) * dt
+        new_x, new_y = solidity.move_arrays(np.column_stack((x, y)), np.column_stack((dx, dy)), settings.ENTITY_SIZE)
+
+        self.vx[moving] = np.where(np.abs(new_x - x - dx) > BOUNCE_EPSILON, -vx, vx)
+        self.vy[moving] = np.where(np.abs(new_y - y - dy) > BOUNCE_EPSILON, -vy, vy)
+        self.x[moving] = new_x
+        self.y[moving] = new_y
+
+
+class EntityStreamState:
+    """
+    which entities one client was sent and where, the SYNC_ENTITIES stream is the difference to the pool
+    """
+    __slots__ = ("sent_id", "sent_x", "sent_y", "sent_tick", "removed")
+
+    def __init__(self) -> None:
+        # per pool slot, sized on first use. an id of 0 means nothing was sent for the slot
+        self.sent_id: Any = None
+        self.sent_x: Any = None
+        self.sent_y: Any = None
+        self.sent_tick: Any = None
+        # id -> resends left, SYNC_ENTITIES is unreliable
+        self.removed: dict[int, int] = {}
+
+
+    def _fit(self, capacity: int) -> None:
+        if self.sent_id is not None and len(self.sent_id) == capacity:
+            return
+        self.sent_id = _filled('I', capacity)
+        self.sent_x = _filled('f', capacity)
+        self.sent_y = _filled('f', capacity)
+        self.sent_tick = _filled('I', capacity)
+
+
+    def _stale_arrays(self, pool: EntityPool, tick: int, viewer: tuple[float, float]) -> tuple[Any, Any]:
+        np = _numpy()
+        ids = (pool.generation.astype(np.uint32) << INDEX_BITS) | np.arange(pool.capacity, dtype=np.uint32)
+        dx, dy = pool.x - viewer[0], pool.y - viewer[1]
+        distance = dx * dx + dy * dy
+        visible = pool.alive.astype(bool) & (distance <= settings.ENTITY_VIEW_DISTANCE**2)
+
+        # known to the client but despawned, replaced in their slot or out of view
+        gone = (self.sent_id != 0) & (~visible | (self.sent_id != ids))
+        for id in self.sent_id[gone].tolist():
+            self.removed[id] = snapshot.REMOVAL_RESENDS
+        self.sent_id[gone] = 0
+
+        changed = visible & ((self.sent_id != ids) | (self.sent_x != pool.x) | (self.sent_y != pool.y))
+        due = visible & ~changed & (tick - self.sent_tick.astype(np.int64) >= settings.ENTITY_REFRESH_TICKS)
+        stale = np.flatnonzero(changed | due)
+
+        # nearest changes first, refreshes of unchanged entities only after every change
+        priority = distance[stale] + np.where(due[stale], 2 * settings.ENTITY_VIEW_DISTANCE**2, 0)
+        return stale, priority
+
+
+    def _commit_arrays(self, pool: EntityPool, chosen: Any, tick: int) -> list[tuple[int, float, float, int]]:
+        np = _numpy()
+        ids = (pool.generation[chosen].astype(np.uint32) << INDEX_BITS) | chosen.astype(np.uint32)
+        x, y = pool.x[chosen], pool.y[chosen]
+        self.sent_id[chosen] = ids
+        self.sent_x[chosen] = x
+        self.sent_y[chosen] = y
+        self.sent_tick[chosen] = tick
+
+        ids = ids.tolist()
+        if self.removed:
+            for id in ids:
+                self.removed.pop(id, None)
+        return list(zip(ids, x.tolist(), y.tolist(), pool.kind[chosen].tolist()))
+
+
+    def _stale_loop(self, pool: EntityPool, tick: int, viewer: tuple[float, float]) -> tuple[list[int], list[float]]:
+        stale: list[int] = []
+        priority: list[float] = []
+        for index in range(pool.capacity):
+            sent = self.sent_id[index]
+            visible = False
+            if pool.alive[index]:
+                id = make_id(index, pool.generation[index])
+                distance = (pool.x[index] - viewer[0])**2 + (pool.y[index] - viewer[1])**2
+                visible = distance <= settings.ENTITY_VIEW_DISTANCE**2
+
+            if sent and (not visible or sent != id):
+                self.removed[sent] = snapshot.REMOVAL_RESENDS
+                self.sent_id[index] = sent = 0
+            if not visible:
+                continue
+
+            if sent != id or self.sent_x[index] != pool.x[index] or self.sent_y[index] != pool.y[index]:
+                stale.append(index)
+                priority.append(distance)
+            elif tick - self.sent_tick[index] >= settings.ENTITY_REFRESH_TICKS:
+                stale.append(index)
+                priority.append(distance + 2 * settings.ENTITY_VIEW_DISTANCE**2)
+        return stale, priority
+
+
+    def _commit_loop(self, pool: EntityPool, chosen: list[int], tick: int) -> list[tuple[int, float, float, int]]:
+        updates = []
+        for index in chosen:
+            id = make_id(index, pool.generation[index])
+            updates.append((id, pool.x[index], pool.y[index], pool.kind[index]))
+            self.sent_id[index] = id
+            self.sent_x[index] = pool.x[index]
+            self.sent_y[index] = pool.y[index]
+            self.sent_tick[index] = tick
+            self.removed.pop(id, None)
+        return updates
+
+
+    def build(self, pool: EntityPool, tick: int, viewer: tuple[float, float], budget: int) -> bytes | None:
+        """
+        encode the nearest entity changes around `viewer` that fit in `budget` bytes, None if there are none
+        """
+        header = packets.Packet.HEADER_SIZE + packets.PayloadFormat.SYNC_ENTITIES_HEADER.size
+        entry_size = packets.PayloadFormat.SYNC_ENTITIES_ENTRY.size
+        removal_size = packets.PayloadFormat.SYNC_ENTITIES_REMOVAL.size
+        np = _numpy()
+
+        with pool._lock:
+            self._fit(pool.capacity)
+            if np is not None:
+                stale, priority = self._stale_arrays(pool, tick, viewer)
+            else:
+                stale, priority = self._stale_loop(pool, tick, viewer)
+
+            removals = list(self.removed.keys())[:max(0, (budget - header) // removal_size)]
+            limit = max(0, (budget - header - len(removals) * removal_size) // entry_size)
+            if not min(limit, len(stale)) and not removals:
+                return None
+
+            if np is not None:
+                if len(stale) > limit:
+                    # only the entries that fit are ordered
+                    keep = np.argpartition(priority, limit)[:limit]
+                    stale, priority = stale[keep], priority[keep]
+                updates = self._commit_arrays(pool, stale[np.argsort(priority)], tick)
+            else:
+                updates = self._commit_loop(pool, [x for _, x in sorted(zip(priority, stale))[:limit]], tick)
+
+        for id in removals:
+            if id not in self.removed:
+                continue
+            self.removed[id] -= 1
+            if self.removed[id] <= 0:
+                self.removed.pop(id)
+
+        return packets.encode_entities(tick, updates, removals)
+
+
+def scatter(pool: EntityPool, solidity: Any, count: int, kind: packets.EntityKind = packets.EntityKind.DRIFTER, rng: random.Random | None = None) -> list[int]:
+    """
+    spawn up to `count` entities centered on random free tiles, drifters head in random directions
+    """
+    rng = rng or random.Random()
+    free = [(x, y) for y in range(solidity.height) for x in range(solidity.width) if not solidity.solid(x, y)]
+    offset = (solidity.tilesize - settings.ENTITY_SIZE) / 2
+    speed = settings.PLAYER_MAX_SPEED / 2 if kind == packets.EntityKind.DRIFTER else 0.
+
+    spawned = []
+    for _ in range(count if free else 0):
+        tile_x, tile_y = rng.choice(free)
+        angle = rng.random() * math.tau
+        id = pool.spawn(
+            kind,
+            (tile_x * solidity.tilesize + offset, tile_y * solidity.tilesize + offset),
+            (math.cos(angle) * speed, math.sin(angle) * speed)
+        )
+        if id is None:
+            break
+        spawned.append(id)
+    return spawned
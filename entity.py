@@ -1,6 +1,6 @@
 from __future__ import annotations
 from abc import ABC
-from typing import Any, Callable
+from typing import Any
 
 import pygame
 
@@ -42,48 +42,12 @@ class Block(Entity):
         return super().render(surf, scroll)
 
 
-class Player(Entity):
-    def __init__(self, pos: tuple[float, float]) -> None:
-        super().__init__(pos = pos)
-        self.velocity = [0.,.0]
-        self.base_acceleration = .25
-        self.acceleration = self.base_acceleration
-        self.max_velocity = .5
-        self.speed = 25
-
-
-    def update_position(self, x: float, y: float) -> None:
-        self.position = (x, y)
-
-
-    def handle_movement(self, keys: pygame.key.ScancodeWrapper, dt: float, broadcast_hook: Callable | None = None):
-        normalized_dt = dt/100
-        if keys[pygame.K_w]:
-            self.velocity[1] = -self.acceleration
-        elif keys[pygame.K_s]:
-            self.velocity[1] = self.acceleration
-        else:
-            self.velocity[1] = 0
-
-        if keys[pygame.K_a]:
-            self.velocity[0] = -self.acceleration
-        elif keys[pygame.K_d]:
-            self.velocity[0] = self.acceleration
-        else:
-            self.velocity[0] = 0
-
-        if self.velocity[0] or self.velocity[1]:
-            self.acceleration *= dt / 14
-            if self.acceleration >= self.max_velocity:
-                self.acceleration = self.max_velocity
-        else:
-            self.acceleration = self.base_acceleration / 4
-
-        delta_x = self.velocity[0] * self.speed * normalized_dt
-        delta_y = self.velocity[1] * self.speed * normalized_dt
-
-        self.update_position(self.position[0] + delta_x, self.position[1] + delta_y)
-
-        if broadcast_hook is not None and any([delta_x, delta_y]):
-            # calls broadcast hook if it is given, and if there is change in position
-            broadcast_hook()
+class Prop(Entity):
+    """
+    a server entity, props of one kind share their image
+    """
+    def __init__(self, pos: tuple[float, float], kind: int, image: pygame.surface.Surface) -> None:
+        super().__init__(pos=pos)
+        self.kind = kind
+        self.image = image
+        self.rect = image.get_rect()
@@ -4,25 +4,30 @@ import pygame
 from typing import Callable
 
 import client
+import collision
 import entity
 import settings
 import packets
+import profiler
 
 pygame.init()
 
 RESOLUTION = 1280, 720
 RENDER_RESOLUTION = 540, 360
 FPS_TARGET = 60
+# past this many dirty rects one full rescale is cheaper than patching each of them
+MAX_DIRTY_RECTS = 64
+ENTITY_COLORS = {
+    packets.EntityKind.PROP: (200, 160, 40),
+    packets.EntityKind.DRIFTER: (230, 60, 60),
+}
 
 
 class Player:
     def __init__(self, x: int = 0, y: int = 0) -> None:
         self.position = pygame.Vector2(x,y)
-        self.velocity = [0.,.0]
-        self.base_acceleration = .25
-        self.acceleration = self.base_acceleration
-        self.max_velocity = .5
-        self.speed = 25
+        self.acceleration = collision.BASE_ACCELERATION
+        self.solidity: collision.SolidityMap | None = None
 
 
     @staticmethod
@@ -38,34 +43,16 @@ class Player:
 
 
     def handle_movement(self, keys: pygame.key.ScancodeWrapper, dt: float, broadcast_hook: Callable | None = None):
-        normalized_dt = dt/100
-        if keys[pygame.K_w]:
-            self.velocity[1] = -self.acceleration
-        elif keys[pygame.K_s]:
-            self.velocity[1] = self.acceleration
-        else:
-            self.velocity[1] = 0
-
-        if keys[pygame.K_a]:
-            self.velocity[0] = -self.acceleration
-        elif keys[pygame.K_d]:
-            self.velocity[0] = self.acceleration
-        else:
-            self.velocity[0] = 0
-
-        if self.velocity[0] or self.velocity[1]:
-            self.acceleration *= dt / 14
-            if self.acceleration >= self.max_velocity:
-                self.acceleration = self.max_velocity
-        else:
-            self.acceleration = self.base_acceleration / 4
-
-        delta_x = self.velocity[0] * self.speed * normalized_dt
-        delta_y = self.velocity[1] * self.speed * normalized_dt
+        direction = (
+            -1 if keys[pygame.K_a] else 1 if keys[pygame.K_d] else 0,
+            -1 if keys[pygame.K_w] else 1 if keys[pygame.K_s] else 0,
+        )
 
-        self.update_position(self.position.x + delta_x, self.position.y + delta_y)
+        previous = self.position.x, self.position.y
+        position, self.acceleration = collision.step(previous, direction, self.acceleration, dt, self.solidity)
+        self.update_position(*position)
 
-        if broadcast_hook is not None and any([delta_x, delta_y]):
+        if broadcast_hook is not None and previous != (self.position.x, self.position.y):
             # calls broadcast hook if it is given, and if there is change in position
             broadcast_hook()
 
@@ -74,12 +61,15 @@ class World:
     def __init__(self) -> None:
         self.world_data: list[list[str]] = []
         self.entites: list[entity.Entity] = []
+        self.tile_rows: list[list[entity.Entity]] = []
 
 
     def update_world_data(self, data: list[list[str]]) -> None:
         self.entites.clear()
+        self.tile_rows.clear()
         self.world_data = data
         for y, array in enumerate(self.world_data):
+            row: list[entity.Entity] = []
             for x, tile in enumerate(array):
                 if tile == "#":
                     entity_tile = entity.Block(
@@ -95,17 +85,27 @@ class World:
                         pygame.color.Color(24, 1, 244))
 
                 self.entites.append(entity_tile)
+                row.append(entity_tile)
+            self.tile_rows.append(row)
 
     def render(self, target_surf: pygame.surface.Surface, scroll: tuple[float, float]) -> None:
-        for ent in self.entites:
-            ent.render(target_surf, scroll)
+        # only tiles overlapping the target's clip area are blitted
+        clip = target_surf.get_clip()
+        x0 = max(0, int((clip.left + scroll[0]) // settings.TILESIZE))
+        x1 = max(0, int((clip.right + scroll[0]) // settings.TILESIZE) + 1)
+        y0 = max(0, int((clip.top + scroll[1]) // settings.TILESIZE))
+        y1 = max(0, int((clip.bottom + scroll[1]) // settings.TILESIZE) + 1)
+
+        for row in self.tile_rows[y0:y1]:
+            for ent in row[x0:x1]:
+                ent.render(target_surf, scroll)
 
 
 class Game:
     def __init__(self) -> None:
         self.display = pygame.display.set_mode(settings.RESOLUTION)
         self.surf = pygame.surface.Surface(settings.RENDER_RESOLUTION)
-        self.player = Player(120, 200)
+        self.player = Player(*settings.SPAWN_POSITION)
         self.world = World()
         self.client = client.Client(
             settings.HOST,
@@ -119,6 +119,59 @@ class Game:
         self.running = True
         self.scroll = (0,0)
 
+        # fixed timestep state, the simulation advances in steps of `tick_length` ms
+        # and rendering interpolates between the previous and current step
+        self.tick_length = 1000 / settings.TICK_RATE
+        self.ticks_per_send = max(1, round(settings.TICK_RATE / settings.SEND_RATE))
+        self.tick = 0
+        self.accumulator = 0.
+        self.previous_position = pygame.Vector2(self.player.position)
+        self.previous_scroll = self.scroll
+        self._position_dirty = False
+        self._rendered_others: dict[int, tuple[float, float]] | None = None
+
+        # presentation state, `surf` is scaled into a preallocated target on the display.
+        # with an integer scale factor only the dirty parts of `surf` are rescaled
+        ratio_x = self.display.get_width() / self.surf.get_width()
+        ratio_y = self.display.get_height() / self.surf.get_height()
+        self.scale_factor = min(ratio_x, ratio_y)
+        self.integer_scale = settings.INTEGER_SCALE or (ratio_x == ratio_y and ratio_x.is_integer())
+        if self.integer_scale:
+            self.scale_factor = max(1, int(self.scale_factor))
+        scaled_size = (
+            int(self.surf.get_width() * self.scale_factor),
+            int(self.surf.get_height() * self.scale_factor)
+        )
+        if self.integer_scale:
+            # letterbox the scaled image in the middle of the window
+            self.present_offset = (
+                (self.display.get_width() - scaled_size[0]) // 2,
+                (self.display.get_height() - scaled_size[1]) // 2
+            )
+        else:
+            # stretch to fill, as before
+            self.present_offset = (0, 0)
+            scaled_size = self.display.get_size()
+        self.present_target = self.display.subsurface(pygame.rect.Rect(self.present_offset, scaled_size))
+        self.scale_x = scaled_size[0] / self.surf.get_width()
+        self.scale_y = scaled_size[1] / self.surf.get_height()
+
+        self.player_sprite = pygame.surface.Surface((settings.TILESIZE, settings.TILESIZE))
+        self.player_sprite.fill((0,255,0))
+        self.other_player_sprite = pygame.surface.Surface((settings.TILESIZE, settings.TILESIZE))
+        self.other_player_sprite.fill((0,0,255))
+        # server entities, drawn as entity.Prop sharing one image per kind
+        self.entity_images: dict[int, pygame.surface.Surface] = {}
+        self.entity_sprites: dict[int, entity.Prop] = {}
+        self._entities_version = -1
+
+        self.profiler = profiler.FrameProfiler(settings.PROFILE, settings.PROFILE_TRACE)
+        self.overlay = profiler.ProfilerOverlay(self.profiler)
+
+        self._full_redraw = True
+        self._rendered_scroll: tuple[float, float] | None = None
+        self._sprite_rects: list[pygame.rect.Rect] = []
+
 
     @property
     def other_players(self) -> list[Player]:
@@ -138,57 +191,266 @@ class Game:
             )))
 
 
-    def render_players(self, entities: list[Player]) -> None:
-        surf = pygame.surface.Surface((settings.TILESIZE, settings.TILESIZE))
-        surf.fill((0,0,255))
-        [self.surf.blit(surf, self.scroll_compensation(entity.position)) for entity in entities]
+    def render_players(self, entities: list[Player], scroll: tuple[float, float] | None = None) -> list[pygame.rect.Rect]:
+        return [self.surf.blit(self.other_player_sprite, self.scroll_compensation(entity.position, scroll)) for entity in entities]
 
 
-    def scroll_compensation(self, position: tuple | pygame.Vector2):
+    def render_props(self, props: list[entity.Prop], rects: list[pygame.rect.Rect], scroll: tuple[float, float]) -> None:
+        # only props overlapping the target's clip area are blitted
+        for index in self.surf.get_clip().collidelistall(rects):
+            props[index].render(self.surf, scroll)
+
+
+    def _entity_image(self, kind: int) -> pygame.surface.Surface:
+        image = self.entity_images.get(kind)
+        if image is None:
+            image = pygame.surface.Surface((settings.ENTITY_SIZE, settings.ENTITY_SIZE))
+            image.fill(ENTITY_COLORS.get(kind, (255, 255, 255)))
+            self.entity_images[kind] = image
+        return image
+
+
+    def _sync_entities(self) -> None:
+        """
+        bring `entity_sprites` in line with the entities the client was last sent
+        """
+        if self._entities_version == self.client.entities_version:
+            return
+        self._entities_version = self.client.entities_version
+        current = self.client.entities.copy()
+
+        for id in self.entity_sprites.keys() - current.keys():
+            del self.entity_sprites[id]
+        for id, (kind, x, y) in current.items():
+            sprite = self.entity_sprites.get(id)
+            if sprite is None or sprite.kind != kind:
+                self.entity_sprites[id] = entity.Prop((x, y), kind, self._entity_image(kind))
+            else:
+                sprite.position = (x, y)
+
+
+    def scroll_compensation(self, position: tuple | pygame.Vector2, scroll: tuple[float, float] | None = None):
         position = tuple(position)
-        return position[0] - self.scroll[0], position[1] - self.scroll[1]
+        scroll = scroll or self.scroll
+        return position[0] - scroll[0], position[1] - scroll[1]
 
 
-    def render_player(self) -> None:
-        surf = pygame.surface.Surface((settings.TILESIZE, settings.TILESIZE))
-        surf.fill((0,255,0))
-        self.surf.blit(surf, self.scroll_compensation(self.player.position))
+    def render_player(self, position: pygame.Vector2 | None = None, scroll: tuple[float, float] | None = None) -> pygame.rect.Rect:
+        position = position if position is not None else self.player.position
+        return self.surf.blit(self.player_sprite, self.scroll_compensation(position, scroll))
 
 
-    def run(self) -> None:
-        self.client.start()
+    def _mark_position_dirty(self) -> None:
+        self._position_dirty = True
 
-        self._send_position()
 
-        while self.running:
-            self.deltatime = self.clock.tick(settings.FPS_TARGET)
-            for event in pygame.event.get():
-                if event == pygame.QUIT:
-                    self.running = False
-
-            self.scroll = (
-                self.scroll[0] + (self.player.position.x - self.scroll[0] - (self.surf.get_width() / 2)) / 10,
-                self.scroll[1] + (self.player.position.y - self.scroll[1] - (self.surf.get_height() / 2)) / 10
-            )
+    def update(self, keys: pygame.key.ScancodeWrapper) -> None:
+        """
+        advance the simulation by exactly one fixed tick
+        """
+        self.previous_position = pygame.Vector2(self.player.position)
+        self.previous_scroll = self.scroll
 
-            if self.client.map_has_changed:
-                self.world.update_world_data(self.client.map)
+        if self.client.spawn is not None:
+            self.player.update_position(*self.client.spawn)
+            self.client.spawn = None
 
-            keys = pygame.key.get_pressed()
-            self.player.handle_movement(keys, self.deltatime, self._send_position)
+        server_position = self.client.server_position
+        if server_position is not None:
+            self.client.server_position = None
+            if self.player.position.distance_to(server_position) > settings.CORRECTION_DISTANCE:
+                # the server disagreed with where we think we are, e.g. it stopped us at a wall
+                self.player.update_position(*server_position)
 
-            self.world.render(self.surf, self.scroll)
-            self.render_players(self.other_players.copy())
-            self.render_player()
-            print(self.player.position)
+        self.player.handle_movement(keys, self.tick_length, self._mark_position_dirty)
+
+        self.scroll = (
+            self.scroll[0] + (self.player.position.x - self.scroll[0] - (self.surf.get_width() / 2)) / 10,
+            self.scroll[1] + (self.player.position.y - self.scroll[1] - (self.surf.get_height() / 2)) / 10
+        )
+
+        self.tick += 1
+        if self._position_dirty and self.tick % self.ticks_per_send == 0:
+            self._send_position()
+            self._position_dirty = False
+
+
+    def toggle_overlay(self) -> None:
+        self.overlay.visible = not self.overlay.visible
+        self.profiler.enabled = self.profiler.configured or self.overlay.visible
+        self._full_redraw = True
+
+
+    def _is_idle(self) -> bool:
+        # nothing to interpolate, nobody else moved and no overlay toggle pending, the last frame is still valid
+        return (
+            not self._full_redraw
+            and self.previous_position == self.player.position
+            and self.previous_scroll == self.scroll
+            and self._rendered_others == self.client.others
+            and self._entities_version == self.client.entities_version
+        )
 
-            resized_surf = pygame.transform.scale(self.surf, self.display.get_size())
-            self.display.blit(resized_surf, (0,0))
 
-            pygame.display.flip()
+    def _sprite_screen_rects(self, position: pygame.Vector2, scroll: tuple[float, float]) -> list[pygame.rect.Rect]:
+        size = (settings.TILESIZE, settings.TILESIZE)
+        rects = [pygame.rect.Rect(self.scroll_compensation(x, scroll), size) for x in (self._rendered_others or {}).values()]
+        rects.append(pygame.rect.Rect(self.scroll_compensation(position, scroll), size))
+        return rects
+
+
+    def _scale_rect(self, rect: pygame.rect.Rect) -> pygame.rect.Rect:
+        """
+        map a rect on `surf` to the covering rect on `present_target`
+        """
+        left = int(rect.left * self.scale_x)
+        top = int(rect.top * self.scale_y)
+        right = -int(-rect.right * self.scale_x // 1)
+        bottom = -int(-rect.bottom * self.scale_y // 1)
+        return pygame.rect.Rect(left, top, right - left, bottom - top).clip(self.present_target.get_rect())
+
+
+    def _present(self, dirty: list[pygame.rect.Rect] | None) -> None:
+        """
+        scale `surf` onto the display and push it, either fully or only the `dirty` rects
+        """
+        if dirty is None:
+            with self.profiler.phase("scale"):
+                pygame.transform.scale(self.surf, self.present_target.get_size(), self.present_target)
+            with self.profiler.phase("flip"):
+                pygame.display.flip()
+            return
+
+        updates = []
+        with self.profiler.phase("scale"):
+            if self.integer_scale:
+                for rect in dirty:
+                    scaled = self._scale_rect(rect)
+                    pygame.transform.scale(self.surf.subsurface(rect), scaled.size, self.present_target.subsurface(scaled))
+                    updates.append(scaled.move(self.present_offset))
+            else:
+                pygame.transform.scale(self.surf, self.present_target.get_size(), self.present_target)
+                updates = [self._scale_rect(rect).move(self.present_offset) for rect in dirty]
+
+        with self.profiler.phase("flip"):
+            pygame.display.update(updates)
+
+
+    def _render_scene(self, scroll: tuple[float, float], position: pygame.Vector2, others: list[Player], props: list[entity.Prop], prop_rects: list[pygame.rect.Rect]) -> None:
+        with self.profiler.phase("world"):
+            self.world.render(self.surf, scroll)
+        with self.profiler.phase("entities"):
+            self.render_props(props, prop_rects, scroll)
+        with self.profiler.phase("players"):
+            self.render_players(others, scroll)
+            self.render_player(position, scroll)
+
+
+    def render(self, alpha: float) -> None:
+        """
+        draw the world, interpolated `alpha` of the way between the previous and current tick
+        """
+        position = self.previous_position.lerp(self.player.position, alpha)
+        scroll = (
+            self.previous_scroll[0] + (self.scroll[0] - self.previous_scroll[0]) * alpha,
+            self.previous_scroll[1] + (self.scroll[1] - self.previous_scroll[1]) * alpha
+        )
 
+        with self.profiler.phase("network"):
+            self._rendered_others = self.client.others.copy()
+            others = [Player.infer_from_data(x) for x in self._rendered_others.values()]
+            self._sync_entities()
+        surf_rect = self.surf.get_rect()
+        props, prop_rects = [], []
+        for sprite in self.entity_sprites.values():
+            rect = pygame.rect.Rect(self.scroll_compensation(sprite.position, scroll), sprite.rect.size)
+            if rect.colliderect(surf_rect):
+                props.append(sprite)
+                prop_rects.append(rect)
+        sprite_rects = self._sprite_screen_rects(position, scroll) + prop_rects
+        overlay_text = [f"pos {self.player.position.x:.1f}, {self.player.position.y:.1f}", f"entities {len(self.entity_sprites)}"]
+
+        dirty = None
+        if not self._full_redraw and scroll == self._rendered_scroll:
+            # camera is still, only the regions sprites left or entered change
+            dirty = [x.clip(surf_rect) for x in self._sprite_rects + sprite_rects]
+            if self.overlay.visible:
+                dirty.append(self.overlay.rect)
+            dirty = [x for x in dirty if x.w and x.h]
+            if len(dirty) > MAX_DIRTY_RECTS:
+                dirty = None
+
+        if dirty is None:
             self.surf.fill(0)
-            self.display.fill(0)
+            self._render_scene(scroll, position, others, props, prop_rects)
+            self.overlay.render(self.surf, self.clock.get_fps(), overlay_text)
+
+            if self._full_redraw:
+                # clears the letterbox borders
+                self.display.fill(0)
+            self._present(None)
+        else:
+            for rect in dirty:
+                self.surf.set_clip(rect)
+                self.surf.fill(0, rect)
+                self._render_scene(scroll, position, others, props, prop_rects)
+            self.surf.set_clip(None)
+            overlay_rect = self.overlay.render(self.surf, self.clock.get_fps(), overlay_text)
+            if overlay_rect is not None:
+                dirty.append(overlay_rect)
+
+            self._present(dirty)
+
+        self._full_redraw = False
+        self._rendered_scroll = scroll
+        self._sprite_rects = sprite_rects
+
+
+    def run(self) -> None:
+        try:
+            self._run()
+        finally:
+            # a crash or ctrl-c still leaves the trace behind
+            self.profiler.write_trace()
+
+
+    def _run(self) -> None:
+        self.client.start()
+
+        self._send_position()
+
+        while self.running:
+            self.deltatime = min(self.clock.tick(settings.FPS_TARGET), settings.MAX_FRAME_TIME)
+            self.accumulator += self.deltatime
+            self.profiler.begin_frame()
+
+            with self.profiler.phase("events"):
+                for event in pygame.event.get():
+                    if event == pygame.QUIT:
+                        self.running = False
+                    if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                        self.toggle_overlay()
+
+            with self.profiler.phase("network"):
+                if self.client.map_has_changed:
+                    self.world.update_world_data(self.client.map)
+                    self.player.solidity = collision.SolidityMap(self.client.map)
+                    self._rendered_others = None
+                    self._full_redraw = True
+
+            with self.profiler.phase("simulation"):
+                keys = pygame.key.get_pressed()
+                while self.accumulator >= self.tick_length:
+                    self.update(keys)
+                    self.accumulator -= self.tick_length
+
+            if self._is_idle():
+                # sleep until the next tick is due instead of redrawing an identical frame
+                pygame.time.wait(int(self.tick_length - self.accumulator))
+                continue
+
+            self.render(self.accumulator / self.tick_length)
+            self.profiler.end_frame()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,518 @@
+"""
+headless load generator, runs many simulated client sessions against a server
+
+    python loadtest.py --clients 200 --processes 4 --duration 30 --spawn-server
+
+every session speaks the same wire protocol as `client.Client` (TCP join, UDP MOVE/SNAPSHOT/PING)
+but runs on asyncio, so a single process can hold hundreds of sessions. the server's own packet
+rates are read from its stats endpoint (--stats-url), a spawned server serves one on STATS_PORT.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import pickle
+import random
+import struct
+import time
+import urllib.parse
+import urllib.request
+
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable
+
+import settings
+import packets
+import reliable
+
+
+@dataclass
+class LoadConfig:
+    host: str = settings.HOST
+    tcp_port: int = settings.TCP_PORT
+    udp_port: int = settings.UDP_PORT
+    clients: int = 50
+    processes: int = 1
+    duration: float = 10.
+    ramp: float = 2.
+    move_rate: float = 10.
+    pattern: str = "random"
+    churn: float = 0.
+    rejoin_delay: float = 1.
+    # churned sessions drop without saying goodbye and come back with their resume token
+    resume: bool = False
+    # drifting entities the spawned server scatters over the map
+    entities: int = 0
+    # the server's stats endpoint, read before and after the run for its packet rates
+    stats_url: str | None = None
+    seed: int = 69420
+
+
+@dataclass
+class SessionStats:
+    joins: int = 0
+    failed_joins: int = 0
+    join_times: list[float] = field(default_factory=list)
+    resumes: int = 0
+    resume_times: list[float] = field(default_factory=list)
+    latencies: list[float] = field(default_factory=list)
+    packets_sent: int = 0
+    packets_received: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    decode_errors: int = 0
+
+    def merge(self, other: SessionStats) -> None:
+        self.joins += other.joins
+        self.failed_joins += other.failed_joins
+        self.join_times.extend(other.join_times)
+        self.resumes += other.resumes
+        self.resume_times.extend(other.resume_times)
+        self.latencies.extend(other.latencies)
+        self.packets_sent += other.packets_sent
+        self.packets_received += other.packets_received
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.decode_errors += other.decode_errors
+
+
+def _random_walk(session: SimulatedSession, t: float) -> tuple[int, int]:
+    x, y = session.position
+    return max(0, x + session.rng.randint(-4, 4)), max(0, y + session.rng.randint(-4, 4))
+
+
+def _circle(session: SimulatedSession, t: float) -> tuple[int, int]:
+    cx, cy = session.origin
+    return int(cx + 32 * math.cos(t + session.phase)), int(cy + 32 * math.sin(t + session.phase))
+
+
+def _idle(session: SimulatedSession, t: float) -> tuple[int, int]:
+    return session.position
+
+
+PATTERNS: dict[str, Callable[[SimulatedSession, float], tuple[int, int]]] = {
+    "random": _random_walk,
+    "circle": _circle,
+    "idle": _idle,
+}
+
+
+async def _read_packet(reader: asyncio.StreamReader) -> tuple[packets.Packet, int]:
+    header = await reader.readexactly(packets.Packet.HEADER_SIZE)
+    _, _, _, payload_length = struct.unpack('IIII', header)
+    payload = await reader.readexactly(payload_length)
+    return packets.Packet.deserialize(header + payload), len(header) + payload_length
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, session: SimulatedSession) -> None:
+        self.session = session
+
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        self.session._handle_udp(data)
+
+
+class SimulatedSession:
+    def __init__(self, config: LoadConfig, stats: SessionStats, rng: random.Random) -> None:
+        self.config = config
+        self.stats = stats
+        self.rng = rng
+        self.pattern = PATTERNS[config.pattern]
+
+        self.auth_id = 0
+        self.id = 0
+        # the map spans MAP_LENGTH tiles, keep the crowd inside it
+        span = settings.MAP_LENGTH * settings.TILESIZE
+        self.origin = (rng.randint(32, span - 32), rng.randint(32, span - 32))
+        self.position = self.origin
+        self.phase = rng.random() * math.tau
+
+        self.writer: asyncio.StreamWriter | None = None
+        self.transport: asyncio.DatagramTransport | None = None
+        self.reliable = reliable.ReliableChannel()
+        self.resume_token: bytes | None = None
+        self._pending: tuple[float, tuple[float, float]] | None = None
+
+
+    async def join(self) -> bool:
+        started = time.perf_counter()
+        resumed = self.resume_token is not None
+        try:
+            reader, self.writer = await asyncio.open_connection(self.config.host, self.config.tcp_port)
+            if self.resume_token is not None:
+                self._send_tcp(packets.Packet(
+                    packets.PacketType.RESUME_REQUEST,
+                    0,
+                    packets.PayloadFormat.RESUME_REQUEST.pack(self.resume_token)
+                ))
+            else:
+                self._send_tcp(packets.Packet(
+                    packets.PacketType.JOIN_REQUEST,
+                    0,
+                    packets.PayloadFormat.JOIN_REQUEST.pack(b"loadtest")
+                ))
+
+            # onboarding is JOIN_RESPONSE, RESUME_TOKEN, MAP_DATA and INITIAL_DATA in that order, a resumed
+            # session stops after the token (or the map if it changed) and the server closes the socket
+            while True:
+                try:
+                    packet, size = await _read_packet(reader)
+                except asyncio.IncompleteReadError as e:
+                    if not resumed or e.partial:
+                        raise
+                    break
+                self.stats.packets_received += 1
+                self.stats.bytes_received += size
+                if packet.packet_type == packets.PacketType.JOIN_RESPONSE:
+                    self.id, = packets.PayloadFormat.JOIN_RESPONSE.unpack(packet.payload)
+                    self.auth_id = packet.auth_id
+                if packet.packet_type == packets.PacketType.RESUME_TOKEN:
+                    self.resume_token, = packets.PayloadFormat.RESUME_TOKEN.unpack(packet.payload)
+                if packet.packet_type == packets.PacketType.INITIAL_DATA:
+                    # the token was not accepted, this was a full join
+                    resumed = False
+                    # start from wherever the server spawned us
+                    spawn = pickle.loads(packet.payload).get(self.id, self.origin)
+                    self.origin = self.position = (int(spawn[0]), int(spawn[1]))
+                    break
+
+            loop = asyncio.get_running_loop()
+            self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UDPProtocol(self),
+                remote_addr=(self.config.host, self.config.udp_port)
+            )
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            logging.debug(f"join failed: {e}")
+            self.stats.failed_joins += 1
+            await self.leave()
+            return False
+
+        if resumed:
+            self.stats.resumes += 1
+            self.stats.resume_times.append(time.perf_counter() - started)
+        else:
+            self.stats.joins += 1
+            self.stats.join_times.append(time.perf_counter() - started)
+        # the server learns our udp address from the first datagram
+        self.send_move()
+        return True
+
+
+    async def leave(self, resumable: bool = False) -> None:
+        if self.transport is not None:
+            if self.auth_id:
+                await self._disconnect(resumable)
+            self.transport.close()
+            self.transport = None
+
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.writer = None
+
+        self.auth_id = 0
+        self.id = 0
+        self.reliable = reliable.ReliableChannel()
+        self._pending = None
+        if not resumable:
+            self.resume_token = None
+
+
+    async def _disconnect(self, resumable: bool = False) -> None:
+        """
+        send DISCONNECT over the reliable channel and wait a little for its ack
+        """
+        disconnect_type = packets.DisconnectEnum.UNEXPECTED if resumable else packets.DisconnectEnum.EXPECTED
+        self._send_reliable(self.reliable.send(
+            packets.PacketType.DISCONNECT,
+            packets.PayloadFormat.DISCONNECT.pack(disconnect_type),
+            time.perf_counter()
+        ))
+        for _ in range(5):
+            await asyncio.sleep(reliable.RESEND_INTERVAL)
+            if not self.reliable.pending:
+                break
+            for wrapped in self.reliable.due(time.perf_counter()):
+                self._send_reliable(wrapped)
+
+
+    def _send_reliable(self, wrapped: bytes) -> None:
+        self._send_udp(packets.Packet(packets.PacketType.RELIABLE, self.auth_id, wrapped).serialize())
+
+
+    def _send_tcp(self, packet: packets.Packet) -> None:
+        assert self.writer is not None
+        data = packet.serialize()
+        self.writer.write(data)
+        self.stats.packets_sent += 1
+        self.stats.bytes_sent += len(data)
+
+
+    def send_move(self) -> None:
+        if self.transport is None:
+            return
+
+        x, y = self.position
+        self._send_udp(packets.Packet(
+            packets.PacketType.MOVE,
+            self.auth_id,
+            packets.PayloadFormat.MOVE.pack(self.id, x, y)
+        ).serialize())
+
+        if self._pending is None:
+            self._pending = (time.perf_counter(), (float(x), float(y)))
+
+
+    def _send_udp(self, data: bytes) -> None:
+        if self.transport is None:
+            return
+        self.transport.sendto(data)
+        self.stats.packets_sent += 1
+        self.stats.bytes_sent += len(data)
+
+
+    def _handle_udp(self, data: bytes) -> None:
+        self.stats.packets_received += 1
+        self.stats.bytes_received += len(data)
+
+        try:
+            packet = packets.Packet.deserialize(data)
+            if packet.packet_type == packets.PacketType.PING:
+                self._send_udp(packets.Packet(packets.PacketType.PONG, self.auth_id, packet.payload).serialize())
+                return
+            if packet.packet_type == packets.PacketType.ACK:
+                self.reliable.on_ack(packet.payload)
+                return
+            if packet.packet_type == packets.PacketType.RELIABLE:
+                _, ack = self.reliable.receive(packet.payload)
+                self._send_udp(packets.Packet(packets.PacketType.ACK, self.auth_id, ack).serialize())
+                return
+            if self._pending is None:
+                return
+            if packet.packet_type == packets.PacketType.SNAPSHOT:
+                _, snapshot, _ = packets.decode_snapshot(packet.payload)
+            elif packet.packet_type == packets.PacketType.SYNC:
+                snapshot = pickle.loads(packet.payload)
+            else:
+                return
+        except Exception:
+            self.stats.decode_errors += 1
+            return
+
+        # latency is measured until the first snapshot that reflects our move
+        sent_at, pos = self._pending
+        own = snapshot.get(self.id)
+        if own == pos:
+            self.stats.latencies.append(time.perf_counter() - sent_at)
+            self._pending = None
+        elif own is not None and math.hypot(own[0] - pos[0], own[1] - pos[1]) > settings.CORRECTION_DISTANCE:
+            # the server stopped us, e.g. at a wall, continue from its position like the game does
+            self.position = (int(own[0]), int(own[1]))
+            self._pending = None
+
+
+    async def run(self, until: float) -> None:
+        interval = 1 / self.config.move_rate if self.config.move_rate > 0 else until
+        started = time.perf_counter()
+        connected = await self.join()
+
+        while time.perf_counter() < until:
+            if not connected:
+                await asyncio.sleep(self.config.rejoin_delay)
+                connected = await self.join()
+                continue
+
+            await asyncio.sleep(interval)
+            self.position = self.pattern(self, time.perf_counter() - started)
+            self.send_move()
+
+            # churn is the chance per second that the session drops and rejoins
+            if self.config.churn and self.rng.random() < self.config.churn * interval:
+                await self.leave(resumable=self.config.resume)
+                connected = False
+
+        await self.leave()
+
+
+async def _run_sessions(config: LoadConfig, count: int, seed: int) -> SessionStats:
+    stats = SessionStats()
+    rng = random.Random(seed)
+    until = time.perf_counter() + config.ramp + config.duration
+
+    async def start(delay: float, session: SimulatedSession) -> None:
+        await asyncio.sleep(delay)
+        await session.run(until)
+
+    await asyncio.gather(*(
+        start(config.ramp * i / max(1, count), SimulatedSession(config, stats, random.Random(rng.random())))
+        for i in range(count)
+    ))
+    return stats
+
+
+def _worker(args: tuple[LoadConfig, int, int]) -> SessionStats:
+    config, count, seed = args
+    logging.getLogger().setLevel(logging.WARNING)
+    return asyncio.run(_run_sessions(config, count, seed))
+
+
+def _run_server(config: LoadConfig) -> None:
+    import server as srvr
+
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(config.seed)
+    stats_port = urllib.parse.urlsplit(config.stats_url).port if config.stats_url else None
+    server = srvr.Server(config.host, config.tcp_port, config.udp_port, stats_port, entity_count=config.entities)
+    server.start()
+    while True:
+        time.sleep(1)
+
+
+def _server_packets(url: str) -> tuple[int, int] | None:
+    """
+    udp packets the server has received and sent so far, None if its stats endpoint can not be read
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            counters = json.loads(response.read())["counters"]
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"could not read server stats from {url}: {e}")
+        return None
+
+    packets_in = sum(v for k, v in counters.items() if k.startswith("udp.packets_in."))
+    packets_out = sum(v for k, v in counters.items() if k.startswith("udp.packets_out."))
+    return packets_in, packets_out
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(config: LoadConfig, stats: SessionStats, elapsed: float, server_packets: tuple[int, int] | None = None) -> dict[str, Any]:
+    """
+    `server_packets` is the difference of the server's udp packets in and out over the run
+    """
+    ms = lambda values, p: round(percentile(values, p) * 1000, 3)
+    clients = max(1, config.clients)
+    return {
+        "config": asdict(config),
+        "elapsed_s": round(elapsed, 3),
+        "joins": stats.joins,
+        "failed_joins": stats.failed_joins,
+        # None when no stats endpoint was given or it could not be read
+        "server_packets_in_per_s": round(server_packets[0] / elapsed, 1) if server_packets else None,
+        "server_packets_out_per_s": round(server_packets[1] / elapsed, 1) if server_packets else None,
+        # counted at the simulated clients
+        "client_packets_in_per_s": round(stats.packets_received / elapsed, 1),
+        "client_packets_out_per_s": round(stats.packets_sent / elapsed, 1),
+        "bytes_in_per_client": stats.bytes_received // clients,
+        "bytes_out_per_client": stats.bytes_sent // clients,
+        "decode_errors": stats.decode_errors,
+        "snapshot_latency_ms": {f"p{p}": ms(stats.latencies, p) for p in (50, 90, 99, 100)},
+        "join_time_ms": {f"p{p}": ms(stats.join_times, p) for p in (50, 90, 99, 100)},
+        "resumes": stats.resumes,
+        "resume_time_ms": {f"p{p}": ms(stats.resume_times, p) for p in (50, 90, 99, 100)},
+        "latency_samples": len(stats.latencies),
+    }
+
+
+def run(config: LoadConfig) -> dict[str, Any]:
+    """
+    run the configured load and return a summary report
+    """
+    per_process = [config.clients // config.processes] * config.processes
+    for i in range(config.clients % config.processes):
+        per_process[i] += 1
+
+    jobs = [(config, count, config.seed + i) for i, count in enumerate(per_process) if count]
+    before = _server_packets(config.stats_url) if config.stats_url else None
+    started = time.perf_counter()
+    stats = SessionStats()
+    if len(jobs) == 1:
+        stats.merge(_worker(jobs[0]))
+    else:
+        with multiprocessing.Pool(len(jobs)) as pool:
+            for result in pool.map(_worker, jobs):
+                stats.merge(result)
+
+    elapsed = time.perf_counter() - started
+    after = _server_packets(config.stats_url) if before is not None else None
+    server_packets = (after[0] - before[0], after[1] - before[1]) if before is not None and after is not None else None
+    return summarize(config, stats, elapsed, server_packets)
+
+
+def main() -> None:
+    defaults = LoadConfig()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=defaults.host)
+    parser.add_argument("--tcp-port", type=int, default=defaults.tcp_port)
+    parser.add_argument("--udp-port", type=int, default=defaults.udp_port)
+    parser.add_argument("--clients", type=int, default=defaults.clients)
+    parser.add_argument("--processes", type=int, default=defaults.processes)
+    parser.add_argument("--duration", type=float, default=defaults.duration, help="seconds of load after ramp-up")
+    parser.add_argument("--ramp", type=float, default=defaults.ramp, help="seconds over which sessions join")
+    parser.add_argument("--move-rate", type=float, default=defaults.move_rate, help="MOVE packets per second per session")
+    parser.add_argument("--pattern", choices=PATTERNS.keys(), default=defaults.pattern)
+    parser.add_argument("--churn", type=float, default=defaults.churn, help="chance per second a session leaves and rejoins")
+    parser.add_argument("--rejoin-delay", type=float, default=defaults.rejoin_delay)
+    parser.add_argument("--resume", action="store_true", help="churned sessions come back with their resume token")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--spawn-server", action="store_true", help="start a local server in a separate process")
+    parser.add_argument("--entities", type=int, default=defaults.entities, help="entities the spawned server simulates")
+    parser.add_argument("--stats-url", help=f"the server's stats endpoint, a spawned server serves http://127.0.0.1:{settings.STATS_PORT}/")
+    parser.add_argument("--json", metavar="PATH", help="also write the report to PATH")
+    args = parser.parse_args()
+
+    stats_url = args.stats_url
+    if stats_url is None and args.spawn_server:
+        stats_url = f"http://127.0.0.1:{settings.STATS_PORT}/"
+
+    config = LoadConfig(
+        host=args.host,
+        tcp_port=args.tcp_port,
+        udp_port=args.udp_port,
+        clients=args.clients,
+        processes=max(1, args.processes),
+        duration=args.duration,
+        ramp=args.ramp,
+        move_rate=args.move_rate,
+        pattern=args.pattern,
+        churn=args.churn,
+        rejoin_delay=args.rejoin_delay,
+        resume=args.resume,
+        entities=args.entities,
+        stats_url=stats_url,
+        seed=args.seed,
+    )
+
+    server_process = None
+    if args.spawn_server:
+        server_process = multiprocessing.Process(target=_run_server, args=(config,), daemon=True)
+        server_process.start()
+        time.sleep(.5)
+
+    try:
+        report = run(config)
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,14 @@
 import os
 import sys
+import json
 import logging
 import time
 
 import server as srvr
 import settings
 
-def main() -> None:
-    server = srvr.Server(settings.HOST, settings.TCP_PORT, settings.UDP_PORT)
+def main(dump: bool = False) -> None:
+    server = srvr.Server(settings.HOST, settings.TCP_PORT, settings.UDP_PORT, settings.STATS_PORT, settings.SERVER_CAPTURE, settings.SERVER_ENTITIES)
 
 
     def run_loop():
@@ -21,9 +22,20 @@ def main() -> None:
             for conn in active_conns :
               print(f"{conn.auth_id} | x, y: {conn.pos[0]}, {conn.pos[1]}")
 
+
+    def dump_loop():
+        # one json object per line, suitable for piping into a file or jq
+        while True:
+            time.sleep(1)
+            print(json.dumps({"time": time.time(), **server.stats()}), flush=True)
+
     try:
         server.start()
-        run_loop()
+        dump_loop() if dump else run_loop()
+
+    except KeyboardInterrupt:
+        # flushes an active packet capture
+        server.stop()
 
     except Exception as e:
         print(e)
@@ -31,5 +43,4 @@ def main() -> None:
 
 if __name__ == "__main__":
     logging.getLogger().setLevel(logging.ERROR)
-    main()
-
+    main(dump="--dump" in sys.argv)
@@ -0,0 +1,177 @@
+from __future__ import annotations
+import bisect
+import json
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import packets
+
+
+# bucket upper bounds in seconds, roughly log spaced from 10us to 1s
+DEFAULT_BUCKETS = (
+    .00001, .000025, .00005, .0001, .00025, .0005,
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.
+)
+
+# bucket upper bounds for sizes and counts, e.g. broadcast fan-out
+COUNT_BUCKETS = tuple(float(2 ** x) for x in range(16))
+
+
+class Histogram:
+    """
+    fixed bucket histogram, cheap enough to observe on every packet
+    """
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.min = float('inf')
+        self.max = 0.
+
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min: self.min = value
+        if value > self.max: self.max = value
+
+
+    def percentile(self, p: float) -> float:
+        """
+        upper bound of the bucket holding the p-th percentile
+        """
+        if not self.count:
+            return 0.
+        target = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+    def snapshot(self) -> dict[str, float | int]:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.,
+            "min": self.min if self.count else 0.,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class Metrics:
+    """
+    named counters and histograms shared by the tcp and udp servers
+    """
+    def __init__(self) -> None:
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+
+    def inc(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            self.histograms[name].observe(value)
+
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+
+    def packet_in(self, protocol: str, packet_type: int, size: int) -> None:
+        self.inc(f"{protocol}.packets_in.{_type_name(packet_type)}")
+        self.inc(f"{protocol}.bytes_in", size)
+
+
+    def packet_out(self, protocol: str, packet_type: int, size: int) -> None:
+        self.inc(f"{protocol}.packets_out.{_type_name(packet_type)}")
+        self.inc(f"{protocol}.bytes_out", size)
+
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "uptime": time.time() - self.started,
+                "counters": dict(sorted(self.counters.items())),
+                "histograms": {k: v.snapshot() for k, v in sorted(self.histograms.items())},
+            }
+
+
+    def dumps(self) -> str:
+        return json.dumps(self.snapshot())
+
+
+def _type_name(packet_type: int) -> str:
+    try:
+        return packets.PacketType(packet_type).name
+    except ValueError:
+        return str(packet_type)
+
+
+class StatsServer:
+    """
+    serves `Metrics.snapshot` as json over http, `curl localhost:<port>/` to read it
+    """
+    def __init__(self, host: str, port: int, metrics: Metrics, extra: Any = None) -> None:
+        # http.server pulls in email and friends, only pay for it when stats are served
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.metrics = metrics
+        # optional callable returning additional fields, e.g. connection counts
+        self.extra = extra
+
+        stats = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = json.dumps(stats.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logging.debug(format, *args)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+
+    def snapshot(self) -> dict[str, Any]:
+        snapshot = self.metrics.snapshot()
+        if self.extra is not None:
+            snapshot.update(self.extra())
+        return snapshot
+
+
+    def start(self) -> None:
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        logging.info(f"stats available on http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}/")
+
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,8 +1,8 @@
-from logging import warning
 import struct
-import settings
 from enum import auto, IntEnum
 
+import tilemap
+
 
 class PacketType(IntEnum):
     JOIN_REQUEST = auto()
@@ -13,6 +13,31 @@ class PacketType(IntEnum):
     INITIAL_DATA = auto()
     SYNC = auto()
     SYNC_ENTITIES = auto()
+    SNAPSHOT = auto()
+    PING = auto()
+    PONG = auto()
+    RELIABLE = auto()
+    ACK = auto()
+    RESUME_REQUEST = auto()
+    RESUME_TOKEN = auto()
+
+
+class EntityKind(IntEnum):
+    """
+    what a SYNC_ENTITIES entry is, see entities.py for how the server simulates them
+    """
+    # stays where it was spawned
+    PROP = 1
+    # moves in a straight line, bouncing off solid tiles
+    DRIFTER = 2
+
+
+class _MapDataFormat:
+    """
+    MAP_DATA depends on the map's size, so the struct is built the first time it is used
+    """
+    def __get__(self, obj, owner) -> struct.Struct:
+        return tilemap.data_format()
 
 
 class PayloadFormat:
@@ -20,10 +45,24 @@ class PayloadFormat:
     JOIN_RESPONSE = struct.Struct('I')
     DISCONNECT = struct.Struct('I')
     MOVE = struct.Struct('III')
-    MAP_DATA = struct.Struct(f'{settings.MAP_LENGTH**2}s')
-
-
-if settings.MAP_LENGTH**2 > 1024: warning(f"map length is getting too large: {settings.MAP_LENGTH**2}")
+    MAP_DATA = _MapDataFormat()
+    # sequence number and the sender's clock, echoed back unchanged in PONG
+    PING = struct.Struct('Id')
+    # tick, update count, removal count, followed by the updates and removed ids
+    SNAPSHOT_HEADER = struct.Struct('IHH')
+    SNAPSHOT_ENTRY = struct.Struct('Iff')
+    SNAPSHOT_REMOVAL = struct.Struct('I')
+    # sequence and inner packet type, followed by the inner payload
+    RELIABLE = struct.Struct('II')
+    # next sequence the receiver expects
+    ACK = struct.Struct('I')
+    # opaque token handed out on join, presented on reconnect to pick the session back up
+    RESUME_TOKEN = struct.Struct('16s')
+    RESUME_REQUEST = RESUME_TOKEN
+    # tick, update count, removal count, followed by id, position and kind per update and the removed ids
+    SYNC_ENTITIES_HEADER = struct.Struct('IHH')
+    SYNC_ENTITIES_ENTRY = struct.Struct('IffB')
+    SYNC_ENTITIES_REMOVAL = struct.Struct('I')
 
 
 class DisconnectEnum(IntEnum):
@@ -66,3 +105,48 @@ class Packet:
         payload = serialized_data[Packet.HEADER_SIZE: Packet.HEADER_SIZE+ payload_length]
 
         return Packet(packet_type, sequence_number, payload)
+
+
+def encode_snapshot(tick: int, updates: list[tuple[int, float, float]], removals: list[int]) -> bytes:
+    parts = [PayloadFormat.SNAPSHOT_HEADER.pack(tick, len(updates), len(removals))]
+    parts += [PayloadFormat.SNAPSHOT_ENTRY.pack(*x) for x in updates]
+    parts += [PayloadFormat.SNAPSHOT_REMOVAL.pack(x) for x in removals]
+    return b"".join(parts)
+
+
+def decode_snapshot(payload: bytes) -> tuple[int, dict[int, tuple[float, float]], list[int]]:
+    tick, update_count, removal_count = PayloadFormat.SNAPSHOT_HEADER.unpack_from(payload, 0)
+    offset = PayloadFormat.SNAPSHOT_HEADER.size
+
+    updates = {}
+    for id, x, y in PayloadFormat.SNAPSHOT_ENTRY.iter_unpack(payload[offset: offset + update_count * PayloadFormat.SNAPSHOT_ENTRY.size]):
+        updates[id] = (x, y)
+    offset += update_count * PayloadFormat.SNAPSHOT_ENTRY.size
+
+    removals = [x for x, in PayloadFormat.SNAPSHOT_REMOVAL.iter_unpack(payload[offset: offset + removal_count * PayloadFormat.SNAPSHOT_REMOVAL.size])]
+
+    return tick, updates, removals
+
+
+def encode_entities(tick: int, updates: list[tuple[int, float, float, int]], removals: list[int]) -> bytes:
+    parts = [PayloadFormat.SYNC_ENTITIES_HEADER.pack(tick, len(updates), len(removals))]
+    parts += [PayloadFormat.SYNC_ENTITIES_ENTRY.pack(*x) for x in updates]
+    parts += [PayloadFormat.SYNC_ENTITIES_REMOVAL.pack(x) for x in removals]
+    return b"".join(parts)
+
+
+def decode_entities(payload: bytes) -> tuple[int, dict[int, tuple[int, float, float]], list[int]]:
+    """
+    SYNC_ENTITIES payload as tick, id -> (kind, x, y) and removed ids
+    """
+    tick, update_count, removal_count = PayloadFormat.SYNC_ENTITIES_HEADER.unpack_from(payload, 0)
+    offset = PayloadFormat.SYNC_ENTITIES_HEADER.size
+
+    updates = {}
+    for id, x, y, kind in PayloadFormat.SYNC_ENTITIES_ENTRY.iter_unpack(payload[offset: offset + update_count * PayloadFormat.SYNC_ENTITIES_ENTRY.size]):
+        updates[id] = (kind, x, y)
+    offset += update_count * PayloadFormat.SYNC_ENTITIES_ENTRY.size
+
+    removals = [x for x, in PayloadFormat.SYNC_ENTITIES_REMOVAL.iter_unpack(payload[offset: offset + removal_count * PayloadFormat.SYNC_ENTITIES_REMOVAL.size])]
+
+    return tick, updates, removals
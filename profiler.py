@@ -0,0 +1,158 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import time
+
+from collections import deque
+from contextlib import nullcontext
+from typing import Any
+
+import pygame
+
+
+# upper bound on buffered trace events, roughly a minute of frames at 60fps
+MAX_TRACE_EVENTS = 250_000
+# weight of the newest frame in the rolling per-phase averages
+SMOOTHING = .05
+
+
+class _Phase:
+    __slots__ = ("profiler", "name", "started")
+
+    def __init__(self, profiler: FrameProfiler, name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.started = 0.
+
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+
+    def __exit__(self, *_: Any) -> None:
+        self.profiler._record(self.name, self.started, time.perf_counter())
+
+
+class FrameProfiler:
+    """
+    per-phase frame timers, optionally buffered as a chrome trace (chrome://tracing, perfetto)
+
+    when disabled `phase` hands back a shared no-op context, so the hooks can stay in the game loop
+    """
+    def __init__(self, enabled: bool = False, trace_path: str | None = None) -> None:
+        self.enabled = enabled or trace_path is not None
+        # what was asked for at startup, the overlay only turns timing on while it is shown
+        self.configured = self.enabled
+        self.trace_path = trace_path
+        self.events: deque[dict[str, Any]] = deque(maxlen=MAX_TRACE_EVENTS)
+        self.averages: dict[str, float] = {}
+        self.frame_average = 0.
+
+        self._null = nullcontext()
+        self._phases: dict[str, _Phase] = {}
+        self._frame: dict[str, float] = {}
+        self._frame_started = 0.
+        self._epoch = time.perf_counter()
+
+
+    def phase(self, name: str) -> _Phase | nullcontext:
+        if not self.enabled:
+            return self._null
+
+        if name not in self._phases:
+            self._phases[name] = _Phase(self, name)
+        return self._phases[name]
+
+
+    def _record(self, name: str, started: float, ended: float) -> None:
+        self._frame[name] = self._frame.get(name, 0.) + ended - started
+        if self.trace_path is not None:
+            self.events.append({
+                "name": name,
+                "ph": "X",
+                "ts": (started - self._epoch) * 1e6,
+                "dur": (ended - started) * 1e6,
+                "pid": os.getpid(),
+                "tid": 1,
+            })
+
+
+    def begin_frame(self) -> None:
+        if not self.enabled:
+            return
+        self._frame.clear()
+        self._frame_started = time.perf_counter()
+
+
+    def end_frame(self) -> None:
+        if not self.enabled:
+            return
+        ended = time.perf_counter()
+        if self.trace_path is not None:
+            self.events.append({
+                "name": "frame",
+                "ph": "X",
+                "ts": (self._frame_started - self._epoch) * 1e6,
+                "dur": (ended - self._frame_started) * 1e6,
+                "pid": os.getpid(),
+                "tid": 0,
+            })
+
+        self.frame_average += (ended - self._frame_started - self.frame_average) * SMOOTHING
+        for name in self.averages.keys() | self._frame.keys():
+            average = self.averages.get(name, 0.)
+            self.averages[name] = average + (self._frame.get(name, 0.) - average) * SMOOTHING
+
+
+    def write_trace(self, path: str | None = None) -> None:
+        path = path or self.trace_path
+        if path is None:
+            return
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": list(self.events), "displayTimeUnit": "ms"}, f)
+        logging.info(f"wrote {len(self.events)} trace events to {path}")
+
+
+class ProfilerOverlay:
+    """
+    draws the rolling phase averages in the top left corner of a surface
+    """
+    def __init__(self, profiler: FrameProfiler, refresh_frames: int = 15) -> None:
+        self.profiler = profiler
+        self.visible = profiler.enabled
+        self.font = pygame.font.Font(None, 14)
+        self.surface: pygame.surface.Surface | None = None
+        self.rect = pygame.rect.Rect(0, 0, 0, 0)
+        # text rendering is not free, the overlay is only re-rendered every `refresh_frames`
+        self.refresh_frames = refresh_frames
+        self._frames = 0
+
+
+    def _render_text(self, fps: float, extra: list[str]) -> pygame.surface.Surface:
+        lines = [f"fps {fps:5.1f}  frame {self.profiler.frame_average * 1000:5.2f}ms"]
+        lines += [f"{name:<10} {value * 1000:5.2f}ms" for name, value in self.profiler.averages.items()]
+        lines += extra
+
+        rendered = [self.font.render(x, False, (255, 255, 255)) for x in lines]
+        height = sum(x.get_height() for x in rendered)
+        width = max(x.get_width() for x in rendered)
+        surf = pygame.surface.Surface((width + 4, height + 4))
+        surf.fill((0, 0, 0))
+        y = 2
+        for line in rendered:
+            surf.blit(line, (2, y))
+            y += line.get_height()
+        return surf
+
+
+    def render(self, target: pygame.surface.Surface, fps: float, extra: list[str] | None = None) -> pygame.rect.Rect | None:
+        if not self.visible:
+            return None
+
+        if self.surface is None or self._frames % self.refresh_frames == 0:
+            self.surface = self._render_text(fps, extra or [])
+        self._frames += 1
+
+        self.rect = target.blit(self.surface, (0, 0))
+        return self.rect
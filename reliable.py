@@ -0,0 +1,103 @@
+from __future__ import annotations
+import threading
+
+from collections import OrderedDict
+
+import packets
+
+
+# seconds between resends of an unacknowledged message, before rtt is known
+RESEND_INTERVAL = .1
+# resends of a single message before the peer is considered gone
+MAX_ATTEMPTS = 30
+# out of order messages buffered ahead of the next expected sequence
+RECEIVE_WINDOW = 256
+
+
+class ReliableChannel:
+    """
+    reliable, ordered messages on top of UDP `Packet`s
+
+    a message travels as a RELIABLE packet whose payload is the sequence number and the inner packet
+    type, followed by the inner payload. the receiver answers with a cumulative ACK holding the next
+    sequence it expects, anything below that is dropped from the sender's resend queue.
+    """
+    def __init__(self) -> None:
+        self.next_sequence = 1
+        self.expected = 1
+        self.failed = False
+        # sequence -> wrapped payload, last send time, attempts
+        self.unacked: OrderedDict[int, list] = OrderedDict()
+        self.received: dict[int, tuple[int, bytes]] = {}
+        self._lock = threading.Lock()
+
+
+    @property
+    def pending(self) -> int:
+        return len(self.unacked)
+
+
+    def send(self, packet_type: packets.PacketType, payload: bytes, now: float) -> bytes:
+        """
+        queue a message and return the RELIABLE payload to send right away
+        """
+        with self._lock:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            wrapped = packets.PayloadFormat.RELIABLE.pack(sequence, packet_type) + payload
+            self.unacked[sequence] = [wrapped, now, 1]
+            return wrapped
+
+
+    def due(self, now: float, rtt: float = 0.) -> list[bytes]:
+        """
+        RELIABLE payloads whose ack is overdue and should be sent again
+        """
+        timeout = max(RESEND_INTERVAL, rtt * 2)
+        resend = []
+        with self._lock:
+            for entry in self.unacked.values():
+                if now - entry[1] < timeout:
+                    continue
+                if entry[2] >= MAX_ATTEMPTS:
+                    self.failed = True
+                    break
+                entry[1] = now
+                entry[2] += 1
+                resend.append(entry[0])
+        return resend
+
+
+    def on_ack(self, payload: bytes) -> None:
+        acked, = packets.PayloadFormat.ACK.unpack(payload)
+        with self._lock:
+            while self.unacked and next(iter(self.unacked)) < acked:
+                self.unacked.popitem(last=False)
+
+
+    def receive_ack(self) -> bytes:
+        """
+        ACK payload for the current receive state
+        """
+        with self._lock:
+            return packets.PayloadFormat.ACK.pack(self.expected)
+
+
+    def receive(self, payload: bytes) -> tuple[list[tuple[int, bytes]], bytes]:
+        """
+        take a RELIABLE payload, returns the messages now deliverable in order and the ACK payload to answer with
+        """
+        sequence, packet_type = packets.PayloadFormat.RELIABLE.unpack_from(payload, 0)
+        inner = payload[packets.PayloadFormat.RELIABLE.size:]
+
+        delivered = []
+        with self._lock:
+            if self.expected <= sequence < self.expected + RECEIVE_WINDOW:
+                self.received[sequence] = (packet_type, inner)
+
+            while self.expected in self.received:
+                delivered.append(self.received.pop(self.expected))
+                self.expected += 1
+
+            # duplicates and messages beyond the window are only acked
+            return delivered, packets.PayloadFormat.ACK.pack(self.expected)
@@ -0,0 +1,222 @@
+"""
+replays the inbound side of a packet capture against a running server, see capture.py for the cli
+
+kept apart from capture.py so the server can record packets without importing asyncio and the
+load generator
+"""
+from __future__ import annotations
+import asyncio
+import math
+import struct
+import time
+
+from typing import Any
+
+import packets
+import capture
+import loadtest
+import reliable
+import settings
+
+
+class _ReplayUDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, session: _ReplaySession) -> None:
+        self.session = session
+
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        self.session.received(data)
+
+
+class _ReplaySession:
+    """
+    stands in for one recorded client, recorded auth ids and player ids are rewritten to the ones the
+    replay target hands out
+    """
+    def __init__(self, stats: loadtest.SessionStats) -> None:
+        self.stats = stats
+        self.auth_id = 0
+        self.id = 0
+        self.writer: asyncio.StreamWriter | None = None
+        self.transport: asyncio.DatagramTransport | None = None
+        self.reliable = reliable.ReliableChannel()
+        # when the oldest unanswered MOVE was sent and where it put us
+        self._pending: tuple[float, tuple[float, float]] | None = None
+
+
+    async def join(self, host: str, tcp_port: int, udp_port: int, request: bytes) -> None:
+        started = time.perf_counter()
+        reader, self.writer = await asyncio.open_connection(host, tcp_port)
+        self.writer.write(request)
+        self.stats.packets_sent += 1
+        self.stats.bytes_sent += len(request)
+
+        while True:
+            packet, size = await loadtest._read_packet(reader)
+            self.stats.packets_received += 1
+            self.stats.bytes_received += size
+            if packet.packet_type == packets.PacketType.JOIN_RESPONSE:
+                self.id, = packets.PayloadFormat.JOIN_RESPONSE.unpack(packet.payload)
+                self.auth_id = packet.auth_id
+            if packet.packet_type == packets.PacketType.INITIAL_DATA:
+                break
+
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _ReplayUDPProtocol(self),
+            remote_addr=(host, udp_port)
+        )
+        self.stats.joins += 1
+        self.stats.join_times.append(time.perf_counter() - started)
+
+
+    def _rewrite(self, packet: packets.Packet) -> bytes:
+        packet.auth_id = self.auth_id
+        if packet.packet_type == packets.PacketType.MOVE:
+            _, x, y = packets.PayloadFormat.MOVE.unpack(packet.payload)
+            packet.payload = packets.PayloadFormat.MOVE.pack(self.id, x, y)
+            if self._pending is None:
+                self._pending = (time.perf_counter(), (float(x), float(y)))
+        return packet.serialize()
+
+
+    def send_udp(self, packet: packets.Packet) -> None:
+        if self.transport is None:
+            return
+        data = self._rewrite(packet)
+        self.transport.sendto(data)
+        self.stats.packets_sent += 1
+        self.stats.bytes_sent += len(data)
+
+
+    def send_event(self, packet: packets.Packet) -> None:
+        """
+        tcp traffic after onboarding, e.g. DISCONNECT in older captures, now goes over the reliable channel
+        """
+        wrapped = self.reliable.send(packets.PacketType(packet.packet_type), packet.payload, time.perf_counter())
+        self.send_udp(packets.Packet(packets.PacketType.RELIABLE, self.auth_id, wrapped))
+
+
+    def received(self, data: bytes) -> None:
+        self.stats.packets_received += 1
+        self.stats.bytes_received += len(data)
+        if self._pending is None:
+            return
+
+        try:
+            packet = packets.Packet.deserialize(data)
+            if packet.packet_type != packets.PacketType.SNAPSHOT:
+                return
+            _, snapshot, _ = packets.decode_snapshot(packet.payload)
+        except (ValueError, struct.error):
+            self.stats.decode_errors += 1
+            return
+
+        # latency is measured until the first snapshot that reflects the replayed move, as in loadtest.py
+        sent_at, pos = self._pending
+        own = snapshot.get(self.id)
+        if own == pos:
+            self.stats.latencies.append(time.perf_counter() - sent_at)
+            self._pending = None
+        elif own is not None and math.hypot(own[0] - pos[0], own[1] - pos[1]) > settings.CORRECTION_DISTANCE:
+            # the server put us somewhere else, e.g. stopped at a wall, this move will never show up
+            self._pending = None
+
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def replay(path: str, host: str, tcp_port: int, udp_port: int, speed: float = 1., drain: float = .5) -> dict[str, Any]:
+    """
+    replay the inbound packets of a capture against a running server, `speed` 0 means no pacing
+    """
+    reader = capture.CaptureReader(path)
+    stats = loadtest.SessionStats()
+    sessions: dict[int, _ReplaySession] = {}
+    # tcp peers are known from the JOIN_REQUEST or RESUME_REQUEST, udp traffic is matched through the recorded auth id
+    by_recorded_auth: dict[int, _ReplaySession] = {}
+    joining: dict[int, _ReplaySession] = {}
+    skipped = 0
+    replayed = 0
+
+    started = time.perf_counter()
+    for record in reader:
+        if record.direction == capture.Direction.OUT:
+            if record.protocol == capture.Protocol.TCP and record.peer in joining:
+                packet = record.packet()
+                if packet.packet_type == packets.PacketType.JOIN_RESPONSE:
+                    by_recorded_auth[packet.auth_id] = joining.pop(record.peer)
+            continue
+
+        if speed > 0:
+            delay = record.timestamp / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        try:
+            packet = record.packet()
+        except ValueError:
+            stats.decode_errors += 1
+            continue
+
+        # a recorded resume carries a token the target never issued, it is answered with a full join
+        if record.protocol == capture.Protocol.TCP and packet.packet_type in (packets.PacketType.JOIN_REQUEST, packets.PacketType.RESUME_REQUEST):
+            session = _ReplaySession(stats)
+            try:
+                await session.join(host, tcp_port, udp_port, bytes(record.data))
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                stats.failed_joins += 1
+                continue
+            sessions[record.peer] = session
+            joining[record.peer] = session
+            replayed += 1
+            continue
+
+        if record.protocol == capture.Protocol.TCP:
+            session = sessions.get(record.peer)
+        else:
+            session = by_recorded_auth.get(packet.auth_id)
+        if session is None:
+            skipped += 1
+            continue
+
+        try:
+            if record.protocol == capture.Protocol.TCP:
+                session.send_event(packet)
+            else:
+                session.send_udp(packet)
+        except (ValueError, struct.error):
+            # the recorder writes inbound packets before the server decodes them, malformed ones included
+            stats.decode_errors += 1
+            continue
+        replayed += 1
+
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(drain)
+    for session in sessions.values():
+        session.close()
+    reader.close()
+
+    ms = lambda values, p: round(loadtest.percentile(values, p) * 1000, 3)
+    return {
+        "path": path,
+        "speed": speed,
+        "elapsed_s": round(elapsed, 3),
+        "replayed_packets": replayed,
+        "skipped_packets": skipped,
+        "replayed_packets_per_s": round(replayed / elapsed, 1) if elapsed else 0.,
+        "sessions": len(sessions),
+        "failed_joins": stats.failed_joins,
+        "packets_received": stats.packets_received,
+        "bytes_received": stats.bytes_received,
+        "decode_errors": stats.decode_errors,
+        "snapshot_latency_ms": {f"p{p}": ms(stats.latencies, p) for p in (50, 90, 99, 100)},
+        "latency_samples": len(stats.latencies),
+        "join_time_ms": {f"p{p}": ms(stats.join_times, p) for p in (50, 90, 99, 100)},
+    }
@@ -6,12 +6,20 @@ import random
 import logging
 import copy
 import time
+import secrets
+import struct
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any
 
 import settings
 import packets
+import metrics
+import capture
+import snapshot
+import reliable
+import tilemap
+import entities
 
 
 RECOVERY_DELAY = 2
@@ -24,6 +32,17 @@ class Connection:
     pos: tuple[float, float]
     active: bool = True
     udp_addr: Any | None = None
+    # last position the client asked for, applied by the next tick within speed and collision limits
+    claimed_pos: tuple[float, float] | None = None
+    link: snapshot.LinkState = field(default_factory=snapshot.LinkState)
+    snapshot_state: snapshot.SnapshotState = field(default_factory=snapshot.SnapshotState)
+    entity_state: entities.EntityStreamState = field(default_factory=entities.EntityStreamState)
+    reliable: reliable.ReliableChannel = field(default_factory=reliable.ReliableChannel)
+    # presented on reconnect to pick this connection back up within settings.RESUME_GRACE
+    resume_token: bytes = field(default_factory=lambda: secrets.token_bytes(packets.PayloadFormat.RESUME_TOKEN.size))
+    map_version: int = 0
+    last_seen: float = field(default_factory=time.perf_counter)
+    resumed: bool = False
 
     def update_pos(self, new_pos: tuple[float | int, float | int]) -> None:
         self.pos = new_pos
@@ -36,25 +55,20 @@ class TCPServer:
         self.port = port
         self.map: list[list[str]]
         self.connections = parent.connections
+        self.metrics = parent.metrics
+        self.recorder = parent.recorder
 
-        self.map = self._generate_map()
+        self.map = tilemap.load()
         self.running = True
         self.dead = False
 
         self.stop = parent.stop
 
         self._iota = 1
-
-
-    def _generate_map(self) -> list[list[str]]:
-        data = []
-        with open('map', 'r') as f:
-            for line in f.readlines():
-                # omitting 'commented' and empty lines
-                if line.startswith("/") or line == "": continue
-                data.append(line.split(','))
-
-        return data
+        # dropped connections that may still resume: token -> connection, expiry
+        self.sessions: dict[bytes, tuple[Connection, float]] = {}
+        self.map_version = 0
+        self._sessions_lock = threading.Lock()
 
 
     def _generate_id(self) -> int:
@@ -62,46 +76,142 @@ class TCPServer:
         return self._iota
 
 
-    def _authenticate(self, conn: socket.socket, addr: Any) -> bool:
+    def _authenticate(self, conn: socket.socket, addr: Any) -> Connection | None:
         response = conn.recv(1024)
+        if self.recorder is not None:
+            self.recorder.record(capture.Direction.IN, capture.Protocol.TCP, addr, response)
 
         packet = packets.Packet.deserialize(response)
+        self.metrics.packet_in("tcp", packet.packet_type, len(response))
 
-        if packet.packet_type != packets.PacketType.JOIN_REQUEST: return False
+        if packet.packet_type == packets.PacketType.RESUME_REQUEST:
+            connection = self._resume_session(conn, addr, packet)
+            if connection is not None:
+                return connection
+            # unknown or expired token, the client is onboarded from scratch
+        elif packet.packet_type != packets.PacketType.JOIN_REQUEST: return None
 
         auth_id = self._generate_auth_id()
         id = self._generate_id()
-        conn.send(
-            packets.Packet(
-                packets.PacketType.JOIN_RESPONSE,
-                auth_id,
-                packets.PayloadFormat.JOIN_RESPONSE.pack(id)
-            ).serialize()
-        )
-        self.connections[auth_id] = Connection(addr, auth_id, id, (0,0))
-        return True
-
-
-    def _onboard_client(self, conn: socket.socket, addr: Any) -> None:
-        auth_id = list(filter(lambda x: x.tcp_addr == addr, self.connections.values()))[0].auth_id
-        logging.info(f"sending map data to {auth_id}")
-        conn.send(
-            packets.Packet(
+        self._send(conn, addr, packets.Packet(
+            packets.PacketType.JOIN_RESPONSE,
+            auth_id,
+            packets.PayloadFormat.JOIN_RESPONSE.pack(id)
+        ))
+        connection = Connection(addr, auth_id, id, settings.SPAWN_POSITION, map_version=self.map_version)
+        self.connections[auth_id] = connection
+        return connection
+
+
+    def _resume_session(self, conn: socket.socket, addr: Any, packet: packets.Packet) -> Connection | None:
+        """
+        hand a dropped connection back to the client holding its token, keeping its id, position and snapshot state
+        """
+        if len(packet.payload) != packets.PayloadFormat.RESUME_REQUEST.size:
+            self.metrics.inc("resume_misses")
+            return None
+
+        token, = packets.PayloadFormat.RESUME_REQUEST.unpack(packet.payload)
+        with self._sessions_lock:
+            self._expire_sessions(time.perf_counter())
+            connection, _ = self.sessions.pop(token, (None, 0.))
+            if connection is None:
+                connection = self._take_over_live(token)
+        if connection is None:
+            self.metrics.inc("resume_misses")
+            return None
+
+        # the old auth id may have been handed out again in the meantime
+        connection.auth_id = self._generate_auth_id()
+        connection.tcp_addr = addr
+        connection.udp_addr = None
+        connection.claimed_pos = None
+        connection.reliable = reliable.ReliableChannel()
+        connection.last_seen = time.perf_counter()
+        connection.resumed = True
+        connection.active = True
+        self._send(conn, addr, packets.Packet(
+            packets.PacketType.JOIN_RESPONSE,
+            connection.auth_id,
+            packets.PayloadFormat.JOIN_RESPONSE.pack(connection.id)
+        ))
+        self.connections[connection.auth_id] = connection
+        return connection
+
+
+    def _take_over_live(self, token: bytes) -> Connection | None:
+        """
+        the client may notice the drop before the server times it out, its connection is still live then
+        """
+        for connection in self.connections.copy().values():
+            if connection.resume_token != token:
+                continue
+            # None means the snapshot thread is dropping it right now, it lands in sessions too late for us
+            if self.connections.pop(connection.auth_id, None) is None:
+                return None
+            logging.info(f"{connection.auth_id} is resuming before it timed out")
+            self.metrics.inc("resume_takeovers")
+            return connection
+        return None
+
+
+    def _expire_sessions(self, now: float) -> None:
+        for token, (_, expires) in list(self.sessions.items()):
+            if expires <= now:
+                del self.sessions[token]
+
+
+    def _send_resume_token(self, conn: socket.socket, addr: Any, connection: Connection) -> None:
+        # a fresh token per session, one that was used to resume is spent
+        connection.resume_token = secrets.token_bytes(packets.PayloadFormat.RESUME_TOKEN.size)
+        self._send(conn, addr, packets.Packet(
+            packets.PacketType.RESUME_TOKEN,
+            connection.auth_id,
+            packets.PayloadFormat.RESUME_TOKEN.pack(connection.resume_token)
+        ))
+
+
+    def _onboard_resumed(self, conn: socket.socket, addr: Any, connection: Connection) -> None:
+        """
+        a resumed client already has the map and the world, snapshots fill in what changed while it was gone
+        """
+        logging.info(f"{connection.id} resumed as {connection.auth_id}")
+        self._send_resume_token(conn, addr, connection)
+        if connection.map_version != self.map_version:
+            self._send(conn, addr, packets.Packet(
                 packets.PacketType.MAP_DATA,
-                auth_id,
+                connection.auth_id,
                 packets.PayloadFormat.MAP_DATA.pack(self._get_map_data())
-            ).serialize()
-        )
+            ))
+            connection.map_version = self.map_version
+
 
-        data = pickle.dumps(self._get_initial_data())
+    def _onboard_client(self, conn: socket.socket, addr: Any, connection: Connection) -> None:
+        auth_id = connection.auth_id
+        self._send_resume_token(conn, addr, connection)
+        logging.info(f"sending map data to {auth_id}")
+        self._send(conn, addr, packets.Packet(
+            packets.PacketType.MAP_DATA,
+            auth_id,
+            packets.PayloadFormat.MAP_DATA.pack(self._get_map_data())
+        ))
+
+        with self.metrics.timer("serialize"):
+            data = pickle.dumps(self._get_initial_data())
         logging.debug(f"onboarding client: {auth_id} with data: {data}")
-        conn.send(
-            packets.Packet(
-                packets.PacketType.INITIAL_DATA,
-                auth_id,
-                data
-            ).serialize()
-        )
+        self._send(conn, addr, packets.Packet(
+            packets.PacketType.INITIAL_DATA,
+            auth_id,
+            data
+        ))
+
+
+    def _send(self, conn: socket.socket, addr: Any, packet: packets.Packet) -> None:
+        data = packet.serialize()
+        conn.send(data)
+        if self.recorder is not None:
+            self.recorder.record(capture.Direction.OUT, capture.Protocol.TCP, addr, data)
+        self.metrics.packet_out("tcp", packet.packet_type, len(data))
 
     def _get_initial_data(self) -> dict[int, tuple[float, float]]:
         temp_conns = list(filter(lambda x : x.active, self.connections.copy().values()))
@@ -110,23 +220,28 @@ class TCPServer:
 
 
     def _get_map_data(self) -> bytes:
-        map_bytes = b"".join("".join(x).encode() for x in self.map)
-        map_bytes = map_bytes.replace(b'\n', b'')
-        return map_bytes
+        return tilemap.payload()
 
 
     def _generate_auth_id(self) -> int:
-        possible = [x for x in range(0, 20000)]
-        for x in self.connections.keys():
-            possible.remove(x)
-
-        return random.choice(possible)
+        # 0 means unauthenticated, collisions are rare enough to just draw again
+        while True:
+            auth_id = random.randint(1, 19999)
+            if auth_id not in self.connections:
+                return auth_id
 
 
-    def _disconnect_connection_by_auth_id(self, auth_id: int) -> None:
+    def _disconnect_connection_by_auth_id(self, auth_id: int, resumable: bool = False) -> None:
+        conn = self.connections.pop(auth_id, None)
+        if conn is None:
+            return
         logging.info(f'{auth_id} disconnected')
-        self.connections[auth_id].active = False
-        self.connections.pop(auth_id)
+        conn.active = False
+        if resumable:
+            now = time.perf_counter()
+            with self._sessions_lock:
+                self._expire_sessions(now)
+                self.sessions[conn.resume_token] = (conn, now + settings.RESUME_GRACE)
 
 
     def disconnect_all_clients(self) -> None:
@@ -134,23 +249,12 @@ class TCPServer:
             self._disconnect_connection_by_auth_id(conn.auth_id)
 
 
-    def handle_client(self, conn: socket.socket, addr: Any) -> None:
-        while True:
-            data = conn.recv(1024)
-            if not data:
-                break
-
-            packet = packets.Packet.deserialize(data)
-
-            if packet.packet_type == packets.PacketType.DISCONNECT:
-                self._disconnect_connection_by_auth_id(packet.auth_id)
-                break
-
-
     def run(self, is_recovery: bool = False) -> None:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             try:
                 self.socket = s
+                # onboarding sockets are closed by us, leaving TIME_WAIT entries on this port
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
                 s.bind((self.host, self.port))
                 s.listen()
                 if is_recovery:
@@ -158,14 +262,41 @@ class TCPServer:
                 while self.running:
                     conn, addr = s.accept()
                     logging.info(f'connection request by {addr}')
+                    accepted = time.perf_counter()
                     with conn:
-                        if not self._authenticate(conn, addr):
-                            break
-
-                        self._onboard_client(conn, addr)
+                        try:
+                            connection = self._authenticate(conn, addr)
+                        except (ValueError, struct.error) as e:
+                            # malformed onboarding only costs this one socket
+                            logging.warning(f"rejecting {addr}: {e}")
+                            self.metrics.inc("tcp.decode_errors")
+                            self.metrics.inc("tcp.rejected")
+                            continue
+                        except OSError as e:
+                            # cut off onboarding only costs this one socket
+                            logging.warning(f"rejecting {addr}: {e}")
+                            self.metrics.inc("tcp.rejected")
+                            continue
+                        if connection is None:
+                            self.metrics.inc("tcp.rejected")
+                            continue
+
+                        try:
+                            if connection.resumed:
+                                self._onboard_resumed(conn, addr, connection)
+                                self.metrics.observe("resume_latency", time.perf_counter() - accepted)
+                                self.metrics.inc("resumes")
+                            else:
+                                self._onboard_client(conn, addr, connection)
+                                self.metrics.observe("join_latency", time.perf_counter() - accepted)
+                                self.metrics.inc("joins")
+                        except OSError as e:
+                            # the client went away mid onboarding, its connection times out like any other
+                            logging.warning(f"onboarding {addr} failed: {e}")
+                            continue
 
                         logging.info(f'{addr} authorized!')
-                        threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True).start()
+                    # the socket is closed here, later events go over the reliable udp channel
 
             except OSError as e:
                 logging.error(f"{e}")
@@ -191,61 +322,32 @@ class UDPServer:
         self.port = port
         self.connections = parent.connections
         self.entities = parent.entities
+        self.metrics = parent.metrics
+        self.recorder = parent.recorder
+        self.solidity = parent.solidity
 
         self.running = True
         self.dead = False
+        self.tick_count = 0
+        self.socket: socket.socket | None = None
 
         self.stop = parent.stop
+        self.disconnect = parent.disconnect
 
 
-    def _get_sync_data(self) -> dict[int, tuple[float, float]]:
-        temp_conns = list(filter(lambda x : x.active, self.connections.copy().values()))
-
-        return {x.id : x.pos for x in temp_conns}
-
-
-    def broadcast(self, socket: socket.socket, packet_type: packets.PacketType, data: bytes, sender_auth_id: int, sender_addr: Any) -> None:
-        """
-        send data to other clients via UDP
-        """
-
-        logging.debug(f"broadcasting {data}")
-        packet = packets.Packet(packet_type=packet_type, auth_id=0, payload=data)
-
-        for conn in list(filter(lambda x: x.active, self.connections.copy().values())):
-            if conn.udp_addr is None:
-                logging.error("a connection is unauthorized")
-                # send disconnect signal
-                return
-
-            packet.auth_id = conn.auth_id
-            socket.sendto(packet.serialize(), conn.udp_addr)
-
-        packet.auth_id = sender_auth_id
-        socket.sendto(packet.serialize(), sender_addr)
-
-
-    def sync(self, socket: socket.socket, sender_auth_id: int, sender_addr: Any) -> None:
-        data = pickle.dumps(self._get_sync_data())
-        for conn in self.connections.copy().values():
-            logging.info(f"sending {self._get_sync_data()}")
-            pack = packets.Packet(
-                packets.PacketType.SYNC,
-                conn.auth_id,
-                data
-            )
-            socket.sendto(pack.serialize(), conn.tcp_addr)
-            logging.info(f"syncing to {conn.tcp_addr} {conn.id} {conn.auth_id}")
-
-        socket.sendto(packets.Packet(packets.PacketType.SYNC, sender_auth_id, data).serialize(), sender_addr)
+    def _record_out(self, addr: Any, data: bytes) -> None:
+        if self.recorder is not None:
+            self.recorder.record(capture.Direction.OUT, capture.Protocol.UDP, addr, data)
 
 
     def run(self) -> None:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
             try:
                 s.bind((self.host, self.port))
+                self.socket = s
+                threading.Thread(target=self._snapshot_loop, args=(s,), daemon=True).start()
                 while self.running:
-                    data, addr = s.recvfrom(1024)
+                    data, addr = s.recvfrom(65535)
                     threading.Thread(target=self._handle_data, args=(s, data, addr), daemon=True).start()
             except:
                 self.stop()
@@ -257,28 +359,175 @@ class UDPServer:
 
 
     def _handle_data(self, socket: socket.socket, data: bytes, addr: Any) -> None:
-        packet = packets.Packet.deserialize(data)
+        with self.metrics.timer("handle"):
+            self._process_data(socket, data, addr)
 
-        if self.connections[packet.auth_id].udp_addr is None:
-            self._onboard_client_udp_addr(packet, addr)
+
+    def _process_data(self, socket: socket.socket, data: bytes, addr: Any) -> None:
+        if self.recorder is not None:
+            self.recorder.record(capture.Direction.IN, capture.Protocol.UDP, addr, data)
+
+        try:
+            packet = packets.Packet.deserialize(data)
+        except ValueError:
+            self.metrics.inc("udp.decode_errors")
+            return
+        self.metrics.packet_in("udp", packet.packet_type, len(data))
 
         logging.debug(f'Received message: {packet.payload} from {packet.auth_id}')
-        if packet.auth_id not in self.connections.keys():
+        conn = self.connections.get(packet.auth_id)
+        if conn is None:
             logging.debug(f'unauthorized package from with auth_id: {packet.auth_id}')
             return
 
+        conn.last_seen = time.perf_counter()
+        if conn.udp_addr is None:
+            self._onboard_client_udp_addr(packet, addr)
+
+        try:
+            self._dispatch(socket, conn, packet)
+        except (ValueError, struct.error):
+            # a valid header around a short or garbled payload
+            self.metrics.inc("udp.decode_errors")
+
+
+    def _dispatch(self, socket: socket.socket, conn: Connection, packet: packets.Packet) -> None:
         if packet.packet_type == packets.PacketType.MOVE:
             _, x, y = packets.PayloadFormat.MOVE.unpack(packet.payload)
-            self.connections[packet.auth_id].update_pos((float(x), float(y)))
+            conn.claimed_pos = (float(x), float(y))
+
+        if packet.packet_type == packets.PacketType.PONG:
+            conn.link.on_pong(packet.payload, time.perf_counter())
+
+        if packet.packet_type == packets.PacketType.ACK:
+            conn.reliable.on_ack(packet.payload)
+
+        if packet.packet_type == packets.PacketType.RELIABLE:
+            delivered, ack = conn.reliable.receive(packet.payload)
+            self._send_to(socket, conn, packets.PacketType.ACK, ack)
+            for packet_type, payload in delivered:
+                self._handle_event(conn, packets.Packet(packet_type, conn.auth_id, payload))
 
 
-        self.broadcast(
-            socket,
-            packets.PacketType.SYNC,
-            pickle.dumps(self._get_sync_data()),
-            packet.auth_id,
-            addr
-        )
+    def _handle_event(self, conn: Connection, packet: packets.Packet) -> None:
+        self.metrics.packet_in("reliable", packet.packet_type, len(packet.payload))
+        if packet.packet_type == packets.PacketType.DISCONNECT:
+            disconnect_type, = packets.PayloadFormat.DISCONNECT.unpack(packet.payload)
+            # a client that did not mean to leave may come back within the grace period
+            self.disconnect(conn.auth_id, resumable=disconnect_type == packets.DisconnectEnum.UNEXPECTED)
+
+
+    def send_reliable(self, conn: Connection, packet_type: packets.PacketType, payload: bytes) -> None:
+        """
+        queue an event for `conn`, it is resent from the snapshot loop until acknowledged
+        """
+        wrapped = conn.reliable.send(packet_type, payload, time.perf_counter())
+        if self.socket is not None and conn.udp_addr is not None:
+            self._send_to(self.socket, conn, packets.PacketType.RELIABLE, wrapped)
+
+
+    def _snapshot_loop(self, socket: socket.socket) -> None:
+        interval = 1 / settings.SNAPSHOT_RATE
+        while self.running:
+            started = time.perf_counter()
+            try:
+                with self.metrics.timer("tick"):
+                    self.tick(socket)
+            except OSError:
+                # socket closed underneath us while shutting down
+                if not self.running:
+                    break
+                logging.exception("snapshot tick failed to send")
+                self.metrics.inc("tick_errors")
+            except Exception:
+                # one bad tick must not stop snapshots for everyone
+                logging.exception("snapshot tick failed")
+                self.metrics.inc("tick_errors")
+            time.sleep(max(0., interval - (time.perf_counter() - started)))
+
+
+    def _send_to(self, socket: socket.socket, conn: Connection, packet_type: packets.PacketType, payload: bytes) -> int:
+        # read once, a resume taking the connection over resets it while a tick may be sending to it
+        addr = conn.udp_addr
+        if addr is None:
+            return 0
+        serialized = packets.Packet(packet_type, conn.auth_id, payload).serialize()
+        socket.sendto(serialized, addr)
+        self._record_out(addr, serialized)
+        self.metrics.packet_out("udp", packet_type, len(serialized))
+        return len(serialized)
+
+
+    def validate_moves(self, conns: list[Connection]) -> None:
+        """
+        move every player towards its claimed position, at most a tick's worth of distance and never into walls
+        """
+        # claims are read once, the receive thread and resumes change them underneath us
+        movers = [(x, x.claimed_pos) for x in conns]
+        movers = [(conn, claim) for conn, claim in movers if claim is not None]
+        if not movers:
+            return
+
+        max_step = settings.PLAYER_MAX_SPEED * settings.MOVE_LEEWAY / settings.SNAPSHOT_RATE
+        positions = self.solidity.validate_many([x.pos for x, _ in movers], [claim for _, claim in movers], max_step)
+        for (conn, claim), pos in zip(movers, positions):
+            conn.update_pos(pos)
+            if pos == claim:
+                conn.claimed_pos = None
+
+
+    def tick(self, socket: socket.socket) -> None:
+        """
+        advance the entities and send every client a snapshot of the most relevant players, then the
+        entity changes around it, as far as its link budget allows
+        """
+        self.tick_count += 1
+        now = time.perf_counter()
+        for conn in self.connections.copy().values():
+            if now - conn.last_seen > settings.CONNECTION_TIMEOUT:
+                logging.info(f"{conn.auth_id} timed out, dropping")
+                self.disconnect(conn.auth_id, resumable=True)
+                self.metrics.inc("timeouts")
+        conns = [x for x in self.connections.copy().values() if x.active and x.udp_addr is not None]
+        with self.metrics.timer("validate"):
+            self.validate_moves(conns)
+        with self.metrics.timer("entities"):
+            self.entities.update(1 / settings.SNAPSHOT_RATE, self.solidity)
+        players = snapshot.PlayerGrid({x.id : x.pos for x in conns})
+
+        started = time.perf_counter()
+        for conn in conns:
+            conn.link.expire(now)
+            ping = conn.link.next_ping(now)
+            if ping is not None:
+                self._send_to(socket, conn, packets.PacketType.PING, ping)
+
+            for wrapped in conn.reliable.due(now, conn.link.rtt):
+                self._send_to(socket, conn, packets.PacketType.RELIABLE, wrapped)
+                self.metrics.inc("reliable.resends")
+            if conn.reliable.failed:
+                logging.info(f"{conn.auth_id} stopped acknowledging, dropping")
+                self.disconnect(conn.auth_id, resumable=True)
+                continue
+
+            budget = conn.link.budget()
+            with self.metrics.timer("serialize"):
+                visible = players.near(conn.pos)
+                conn.snapshot_state.prioritize(conn.pos, visible)
+                payload = conn.snapshot_state.build(self.tick_count, visible, budget)
+            if payload is not None:
+                conn.link.spend(self._send_to(socket, conn, packets.PacketType.SNAPSHOT, payload))
+                self.metrics.observe("snapshot_size", len(payload), metrics.COUNT_BUCKETS)
+
+            # entities get whatever the player snapshot left over
+            with self.metrics.timer("serialize_entities"):
+                payload = conn.entity_state.build(self.entities, self.tick_count, conn.pos, conn.link.remaining())
+            if payload is not None:
+                conn.link.spend(self._send_to(socket, conn, packets.PacketType.SYNC_ENTITIES, payload))
+                self.metrics.observe("entity_sync_size", len(payload), metrics.COUNT_BUCKETS)
+
+        self.metrics.observe("broadcast", time.perf_counter() - started)
+        self.metrics.observe("broadcast_fan_out", len(conns), metrics.COUNT_BUCKETS)
 
 
     def _stop(self) -> None:
@@ -286,29 +535,81 @@ class UDPServer:
 
 
 class Server:
-    def __init__(self, host: str, tcp_port: int, udp_port: int) -> None:
+    def __init__(self, host: str, tcp_port: int, udp_port: int, stats_port: int | None = None, capture_path: str | None = None, entity_count: int = 0, stats_host: str = settings.STATS_HOST) -> None:
         self.connections: dict[int, Connection] = {}
-        self.entities: dict[int, tuple[float, float]] = {}
+        self.entities = entities.EntityPool()
+        self.metrics = metrics.Metrics()
+        self.recorder: capture.PacketRecorder | None = None
+        if capture_path is not None:
+            self.recorder = capture.PacketRecorder(capture_path)
+            logging.info(f"capturing packets to {capture_path}")
 
         self.tcp_server = TCPServer(host, tcp_port, self)
+        self.solidity = tilemap.solidity()
+        if entity_count:
+            spawned = entities.scatter(self.entities, self.solidity, entity_count)
+            logging.info(f"spawned {len(spawned)} entities")
         self.udp_server = UDPServer(host, udp_port, self)
+        self.stats_server: metrics.StatsServer | None = None
+        if stats_port is not None:
+            self.stats_server = metrics.StatsServer(stats_host, stats_port, self.metrics, self._connection_stats)
+
+
+    def _connection_stats(self) -> dict[str, Any]:
+        conns = self.connections.copy().values()
+        return {
+            "connections": len(conns),
+            "active_connections": sum(1 for x in conns if x.active),
+            "resumable_sessions": len(self.tcp_server.sessions),
+            "entities": len(self.entities),
+        }
+
+
+    def stats(self) -> dict[str, Any]:
+        snapshot = self.metrics.snapshot()
+        snapshot.update(self._connection_stats())
+        return snapshot
 
 
     def start(self) -> None:
         threading.Thread(target=self.tcp_server.run, daemon=True).start()
         threading.Thread(target=self.udp_server.run, daemon=True).start()
+        if self.stats_server is not None:
+            self.stats_server.start()
         logging.info("threads running...")
 
 
+    def disconnect(self, auth_id: int, resumable: bool = False) -> None:
+        self.tcp_server._disconnect_connection_by_auth_id(auth_id, resumable)
+
+
+    def send_map(self) -> None:
+        """
+        push the current map to every client over the reliable channel
+        """
+        payload = packets.PayloadFormat.MAP_DATA.pack(self.tcp_server._get_map_data())
+        # connections waiting to resume get the map when they come back
+        self.tcp_server.map_version += 1
+        for conn in self.connections.copy().values():
+            if conn.active:
+                self.udp_server.send_reliable(conn, packets.PacketType.MAP_DATA, payload)
+                conn.map_version = self.tcp_server.map_version
+
+
     def stop(self) -> None:
         self.udp_server._stop()
         self.tcp_server._stop()
+        if self.stats_server is not None:
+            self.stats_server.stop()
+            self.stats_server = None
+        if self.recorder is not None:
+            self.recorder.close()
 
 
 if __name__ == "__main__":
     random.seed(69420)
 
-    server = Server(settings.HOST, int(settings.TCP_PORT), int(settings.UDP_PORT))
+    server = Server(settings.HOST, int(settings.TCP_PORT), int(settings.UDP_PORT), settings.STATS_PORT, settings.SERVER_CAPTURE, settings.SERVER_ENTITIES)
     server.start()
     try:
         while True:
@@ -6,10 +6,70 @@ logging.getLogger().setLevel(logging.INFO)
 HOST = os.environ['HOST'] if 'HOST' in os.environ.keys() else 'localhost'
 TCP_PORT = int(os.environ['TCP_PORT']) if 'TCP_KEYS' in os.environ.keys() else 8881
 UDP_PORT = int(os.environ['UDP_PORT']) if 'UDP_KEYS' in os.environ.keys() else 8888
+# server snapshot ticks per second
+SNAPSHOT_RATE = 20
+# per-client snapshot bandwidth in bytes per second, adapted between the bounds by loss and rtt
+SNAPSHOT_BANDWIDTH = 16_000
+MIN_SNAPSHOT_BANDWIDTH = 2_000
+MAX_SNAPSHOT_BANDWIDTH = 64_000
+# largest snapshot datagram, kept below a typical MTU
+MAX_SNAPSHOT_BYTES = 1200
+PING_INTERVAL = .5
+PING_TIMEOUT = 2.
+# a client that has sent nothing for this many seconds is dropped, it may resume within the grace period
+CONNECTION_TIMEOUT = 5.
+RESUME_GRACE = 30.
+# players further than this (pixels) from a client are left out of its snapshots, and of a crowd
+# only the nearest MAX_VISIBLE_PLAYERS are tracked per client
+PLAYER_VIEW_DISTANCE = 400
+MAX_VISIBLE_PLAYERS = 64
+# server-side entities besides players, see entities.py. SERVER_ENTITIES drifters are scattered on start
+MAX_ENTITIES = 4096
+SERVER_ENTITIES = int(os.environ['SERVER_ENTITIES']) if 'SERVER_ENTITIES' in os.environ.keys() else 0
+ENTITY_SIZE = 8
+# entities further than this (pixels) from a player are not streamed to it
+ENTITY_VIEW_DISTANCE = 400
+# snapshot ticks after which an unchanged entity is sent again, covering lost SYNC_ENTITIES datagrams
+ENTITY_REFRESH_TICKS = SNAPSHOT_RATE * 2
+# local http endpoint serving server metrics as json, only reachable from this machine unless STATS_HOST says otherwise
+STATS_HOST = os.environ['STATS_HOST'] if 'STATS_HOST' in os.environ.keys() else '127.0.0.1'
+STATS_PORT = int(os.environ['STATS_PORT']) if 'STATS_PORT' in os.environ.keys() else 8889
+# when set, the server records every packet it sends and receives to this file, see capture.py
+SERVER_CAPTURE = os.environ['SERVER_CAPTURE'] if 'SERVER_CAPTURE' in os.environ.keys() else None
 
-MAP_LENGTH = len(open('map', 'r').readline().replace(',', '')) - 1
+# resolved next to this file rather than the working directory, read lazily through tilemap.py
+MAP_PATH = os.environ['MAP_PATH'] if 'MAP_PATH' in os.environ.keys() else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'map')
 
 RESOLUTION = 1280, 720
 RENDER_RESOLUTION = 540, 360
 FPS_TARGET = 60
+# simulation ticks per second, independent of the render frame rate
+TICK_RATE = 60
+# position updates sent to the server per second
+SEND_RATE = 30
+# upper bound on a single frame's delta (ms) to avoid a spiral of death after stalls
+MAX_FRAME_TIME = 250
+# letterbox the render surface at the largest whole-number scale, enables partial rescaling
+INTEGER_SCALE = False
 TILESIZE = 16
+# map tiles that block movement, '#' is floor
+SOLID_TILES = "h"
+SPAWN_POSITION = 120, 200
+# fastest a player can legitimately move in pixels per second, and the slack the server allows on top
+PLAYER_MAX_SPEED = 125
+MOVE_LEEWAY = 1.5
+# the client snaps to the server's position for it when they drift further apart than this
+CORRECTION_DISTANCE = TILESIZE * 2
+
+# client frame profiler, F3 toggles the overlay in game
+PROFILE = 'PROFILE' in os.environ.keys()
+# when set, a chrome trace of the profiled phases is written here on exit
+PROFILE_TRACE = os.environ['PROFILE_TRACE'] if 'PROFILE_TRACE' in os.environ.keys() else None
+
+
+def __getattr__(name: str):
+    # MAP_LENGTH needs the map file, it is only read once somebody asks for it
+    if name == "MAP_LENGTH":
+        import tilemap
+        return tilemap.length()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
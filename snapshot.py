@@ -0,0 +1,238 @@
+from __future__ import annotations
+import heapq
+import math
+
+from typing import Any
+
+import settings
+import packets
+
+
+# how many ticks a removal is repeated, snapshots are unreliable
+REMOVAL_RESENDS = 3
+# smoothing factors for the rtt and loss estimates
+RTT_SMOOTHING = .125
+LOSS_SMOOTHING = .1
+# loss rate above which the bandwidth is cut
+LOSS_THRESHOLD = .05
+# multiplicative decrease and additive increase (bytes/s) of the bandwidth budget
+BANDWIDTH_DECREASE = .7
+BANDWIDTH_INCREASE = 1_000
+
+# priority accumulator weights, see `SnapshotState.prioritize`
+PRIORITY_BASE = .05
+PRIORITY_CHANGE = .25
+PRIORITY_NEAR = 1.
+# unchanged entities are only refreshed once their priority climbs this high, a nearby player
+# gains about one per tick so it is resent roughly once a second rather than every tick
+REFRESH_PRIORITY = 20.
+
+
+class LinkState:
+    """
+    per-connection link estimate from the PING/PONG exchange, drives the snapshot byte budget
+    """
+    def __init__(self) -> None:
+        self.rtt = 0.
+        self.min_rtt = math.inf
+        self.loss = 0.
+        self.bandwidth = float(settings.SNAPSHOT_BANDWIDTH)
+        self.tokens = 0.
+
+        self._ping_sequence = 0
+        self._last_ping = 0.
+        self._pending: dict[int, float] = {}
+
+
+    def next_ping(self, now: float) -> bytes | None:
+        """
+        PING payload if one is due
+        """
+        if now - self._last_ping < settings.PING_INTERVAL:
+            return None
+
+        self._last_ping = now
+        self._ping_sequence += 1
+        self._pending[self._ping_sequence] = now
+        return packets.PayloadFormat.PING.pack(self._ping_sequence, now)
+
+
+    def on_pong(self, payload: bytes, now: float) -> None:
+        sequence, _ = packets.PayloadFormat.PING.unpack(payload)
+        sent = self._pending.pop(sequence, None)
+        if sent is None:
+            return
+
+        sample = now - sent
+        self.rtt = sample if not self.rtt else self.rtt + (sample - self.rtt) * RTT_SMOOTHING
+        self.min_rtt = min(self.min_rtt, sample)
+        self._on_outcome(False)
+
+
+    def expire(self, now: float) -> None:
+        for sequence, sent in list(self._pending.items()):
+            # a PONG handled on the receiving thread may have claimed it in the meantime
+            if now - sent > settings.PING_TIMEOUT and self._pending.pop(sequence, None) is not None:
+                self._on_outcome(True)
+
+
+    def _on_outcome(self, lost: bool) -> None:
+        self.loss += ((1. if lost else 0.) - self.loss) * LOSS_SMOOTHING
+
+        # rtt far above the best seen means queues are building up somewhere
+        congested = self.min_rtt != math.inf and self.rtt > self.min_rtt * 2 + .05
+        if lost or self.loss > LOSS_THRESHOLD or congested:
+            self.bandwidth = max(settings.MIN_SNAPSHOT_BANDWIDTH, self.bandwidth * BANDWIDTH_DECREASE)
+        else:
+            self.bandwidth = min(settings.MAX_SNAPSHOT_BANDWIDTH, self.bandwidth + BANDWIDTH_INCREASE)
+
+
+    def budget(self) -> int:
+        """
+        refill the token bucket for one tick and return the bytes that may be sent
+        """
+        per_tick = self.bandwidth / settings.SNAPSHOT_RATE
+        self.tokens = min(self.tokens + per_tick, per_tick + settings.MAX_SNAPSHOT_BYTES)
+        return int(min(self.tokens, settings.MAX_SNAPSHOT_BYTES))
+
+
+    def spend(self, size: int) -> None:
+        self.tokens -= size
+
+
+    def remaining(self) -> int:
+        """
+        bytes left of the budget after what this tick already spent
+        """
+        return int(max(0., min(self.tokens, settings.MAX_SNAPSHOT_BYTES)))
+
+
+def _numpy() -> Any:
+    """
+    numpy if it is installed, imported on first use so importing the server stays cheap
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class PlayerGrid:
+    """
+    player positions gathered once per tick, so every client is only handed its nearest
+    `MAX_VISIBLE_PLAYERS` within view distance instead of the whole server
+
+    with numpy the lookup is a vectorized distance and argpartition, without it players are bucketed
+    into view-distance sized cells and only the 3x3 cells around the viewer are looked at
+    """
+    def __init__(self, players: dict[int, tuple[float, float]], view_distance: float = settings.PLAYER_VIEW_DISTANCE, limit: int = settings.MAX_VISIBLE_PLAYERS) -> None:
+        self.view_distance = view_distance
+        self.limit = limit
+        self.np = _numpy()
+        if self.np is not None:
+            self.ids = self.np.fromiter(players.keys(), dtype=self.np.int64, count=len(players))
+            pos = self.np.array(list(players.values()), dtype=self.np.float64).reshape(-1, 2)
+            self.x, self.y = pos[:, 0], pos[:, 1]
+            return
+
+        self.cells: dict[tuple[int, int], list[tuple[int, tuple[float, float]]]] = {}
+        for id, pos in players.items():
+            self.cells.setdefault(self._cell(pos), []).append((id, pos))
+
+
+    def _cell(self, pos: tuple[float, float]) -> tuple[int, int]:
+        return int(pos[0] // self.view_distance), int(pos[1] // self.view_distance)
+
+
+    def near(self, viewer: tuple[float, float]) -> dict[int, tuple[float, float]]:
+        """
+        the players `viewer` gets snapshots of, nearest first
+        """
+        if self.np is not None:
+            return self._near_arrays(viewer)
+
+        cx, cy = self._cell(viewer)
+        candidates = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for id, pos in self.cells.get((cx + dx, cy + dy), ()):
+                    distance = (pos[0] - viewer[0])**2 + (pos[1] - viewer[1])**2
+                    if distance <= self.view_distance**2:
+                        candidates.append((distance, id, pos))
+        return {id: pos for _, id, pos in heapq.nsmallest(self.limit, candidates)}
+
+
+    def _near_arrays(self, viewer: tuple[float, float]) -> dict[int, tuple[float, float]]:
+        np = self.np
+        distance = (self.x - viewer[0])**2 + (self.y - viewer[1])**2
+        chosen = np.flatnonzero(distance <= self.view_distance**2)
+        if len(chosen) > self.limit:
+            chosen = chosen[np.argpartition(distance[chosen], self.limit - 1)[:self.limit]]
+        return dict(zip(self.ids[chosen].tolist(), zip(self.x[chosen].tolist(), self.y[chosen].tolist())))
+
+
+class SnapshotState:
+    """
+    what one client has been sent, and the priority accumulator deciding what it gets next
+    """
+    def __init__(self) -> None:
+        self.sent: dict[int, tuple[float, float]] = {}
+        self.priority: dict[int, float] = {}
+        self.removed: dict[int, int] = {}
+
+
+    def prioritize(self, viewer: tuple[float, float], entities: dict[int, tuple[float, float]]) -> None:
+        """
+        accumulate priority for every entity, nearer and more changed entities grow faster.
+        `entities` is what the client can see (see `PlayerGrid.near`), anything that left it is removed
+        """
+        for id in self.priority.keys() - entities.keys():
+            self.priority.pop(id)
+            if self.sent.pop(id, None) is not None:
+                self.removed[id] = REMOVAL_RESENDS
+
+        for id, pos in entities.items():
+            if id in self.removed:
+                self.removed.pop(id)
+            last = self.sent.get(id)
+            change = math.inf if last is None else abs(pos[0] - last[0]) + abs(pos[1] - last[1])
+            distance = math.hypot(pos[0] - viewer[0], pos[1] - viewer[1]) / settings.TILESIZE
+
+            priority = self.priority.get(id, 0.) + PRIORITY_BASE + PRIORITY_NEAR / (1 + distance)
+            if change:
+                priority += PRIORITY_CHANGE * min(change, settings.TILESIZE * 4)
+                if last is None:
+                    priority += REFRESH_PRIORITY
+            self.priority[id] = priority
+
+
+    def build(self, tick: int, entities: dict[int, tuple[float, float]], budget: int) -> bytes | None:
+        """
+        encode the highest priority updates that fit in `budget` bytes, None if nothing is worth sending
+        """
+        header = packets.Packet.HEADER_SIZE + packets.PayloadFormat.SNAPSHOT_HEADER.size
+        removal_size = packets.PayloadFormat.SNAPSHOT_REMOVAL.size
+        entry_size = packets.PayloadFormat.SNAPSHOT_ENTRY.size
+
+        removals = list(self.removed.keys())[:max(0, (budget - header) // removal_size)]
+        room = budget - header - len(removals) * removal_size
+
+        # unchanged entities wait until they are due for a refresh, every entry costs the same so
+        # the best that fit are the `room // entry_size` highest priorities, no full sort needed
+        due = [id for id, priority in self.priority.items() if priority >= REFRESH_PRIORITY or self.sent.get(id) != entities[id]]
+        chosen = heapq.nlargest(max(0, room // entry_size), due, key=self.priority.__getitem__)
+        updates = [(id, entities[id][0], entities[id][1]) for id in chosen]
+
+        if not updates and not removals:
+            return None
+
+        for id, x, y in updates:
+            self.sent[id] = (x, y)
+            self.priority[id] = 0.
+        for id in removals:
+            self.removed[id] -= 1
+            if self.removed[id] <= 0:
+                self.removed.pop(id)
+
+        return packets.encode_snapshot(tick, updates, removals)
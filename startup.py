@@ -0,0 +1,103 @@
+"""
+startup benchmark, times how long fresh interpreters take to import each entry point
+
+    python startup.py --repeat 20
+    python startup.py --json startup.json
+
+every sample is a new process started from a scratch directory, so a module that reads files
+relative to the working directory fails here. headless entry points importing pygame fail too.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# name -> statement run in the fresh interpreter, and whether it may import pygame
+ENTRY_POINTS: dict[str, tuple[str, bool]] = {
+    "settings": ("import settings", False),
+    "packets": ("import packets", False),
+    "client": ("import client", False),
+    "server": ("import server", False),
+    "server_init": ("import server; server.Server('localhost', 0, 0)", False),
+    "monitor": ("import main", False),
+    "loadtest": ("import loadtest", False),
+    "capture": ("import capture", False),
+    "replay": ("import replay", False),
+    "game": ("import game", True),
+}
+
+# modules worth knowing about when they show up in a startup
+HEAVY = ("pygame", "numpy", "asyncio", "multiprocessing", "http.server", "collision", "loadtest")
+
+
+def _sample(statement: str, cwd: str) -> tuple[float, list[str]]:
+    code = f"{statement}\nimport sys, json\nprint(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))"
+    env = dict(os.environ, PYTHONPATH=ROOT, PYGAME_HIDE_SUPPORT_PROMPT="1", SDL_VIDEODRIVER="dummy")
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}")
+    return elapsed, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(repeat: int, names: list[str]) -> dict[str, Any]:
+    """
+    time every entry point `repeat` times, relative to a bare interpreter
+    """
+    ms = lambda seconds: round(seconds * 1000, 2)
+    report: dict[str, Any] = {"python": sys.version.split()[0], "repeat": repeat, "entry_points": {}}
+    with tempfile.TemporaryDirectory() as cwd:
+        bare = statistics.median(_sample("pass", cwd)[0] for _ in range(repeat))
+        report["interpreter_ms"] = ms(bare)
+
+        for name in names:
+            statement, allows_pygame = ENTRY_POINTS[name]
+            try:
+                samples = [_sample(statement, cwd) for _ in range(repeat)]
+            except RuntimeError as e:
+                report["entry_points"][name] = {"error": str(e)}
+                continue
+
+            times = [x[0] for x in samples]
+            imported = samples[-1][1]
+            report["entry_points"][name] = {
+                "median_ms": ms(statistics.median(times)),
+                "min_ms": ms(min(times)),
+                "over_interpreter_ms": ms(statistics.median(times) - bare),
+                "heavy_imports": imported,
+                "ok": allows_pygame or "pygame" not in imported,
+            }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="fresh interpreters per entry point")
+    parser.add_argument("--only", nargs="+", choices=ENTRY_POINTS.keys(), help="time these entry points only")
+    parser.add_argument("--json", metavar="PATH", help="also write the report to PATH")
+    args = parser.parse_args()
+
+    report = run(max(1, args.repeat), args.only or list(ENTRY_POINTS))
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = [name for name, x in report["entry_points"].items() if not x.get("ok", False)]
+    if failed:
+        sys.exit(f"failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
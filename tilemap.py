@@ -0,0 +1,60 @@
+"""
+the map file, read and compiled on first use
+
+nothing here touches the disk at import time. every accessor is cached per path, so the server,
+the snapshot code and tools share a single parse of the file and a single compiled `SolidityMap`.
+"""
+from __future__ import annotations
+import logging
+import struct
+
+from functools import lru_cache
+
+import settings
+
+
+# MAP_DATA is sent in one piece over the onboarding socket
+MAX_MAP_BYTES = 1024
+
+
+@lru_cache(maxsize=None)
+def load(path: str = settings.MAP_PATH) -> list[list[str]]:
+    data = []
+    with open(path, 'r') as f:
+        for line in f.readlines():
+            # omitting 'commented' and empty lines
+            if line.startswith("/") or line == "": continue
+            data.append(line.split(','))
+
+    return data
+
+
+@lru_cache(maxsize=None)
+def length(path: str = settings.MAP_PATH) -> int:
+    """
+    tiles per row, the map is sent as a square of this side
+    """
+    rows = load(path)
+    return len("".join(rows[0]).strip()) if rows else 0
+
+
+@lru_cache(maxsize=None)
+def payload(path: str = settings.MAP_PATH) -> bytes:
+    map_bytes = b"".join("".join(x).encode() for x in load(path))
+    return map_bytes.replace(b'\n', b'')
+
+
+@lru_cache(maxsize=None)
+def data_format(path: str = settings.MAP_PATH) -> struct.Struct:
+    size = length(path)**2
+    if size > MAX_MAP_BYTES: logging.warning(f"map length is getting too large: {size}")
+    return struct.Struct(f'{size}s')
+
+
+@lru_cache(maxsize=None)
+def solidity(path: str = settings.MAP_PATH):
+    """
+    the compiled `collision.SolidityMap`, collision (and numpy) is only imported by whoever asks for it
+    """
+    import collision
+    return collision.SolidityMap(load(path))